@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+prism_central.py benchmarks
+===========================
+
+Times prism_central.py against a local mock PrismCentral (see
+mock_prism_central.py) for estates of several sizes, and reports for each
+scenario the wall time, the peak RSS of the script and the requests and bytes
+PrismCentral sent.
+
+Scenarios:
+ - list_miss    --list with an empty cache
+ - list         --list with the other resources cached
+ - list_hit     --list --force-cache, answered from the cache
+ - all_miss     --all --refresh-cache
+ - host_hit     --host answered from the host index
+ - host_miss    --host with an empty cache
+
+The script is copied to a scratch directory next to a generated
+prism_central.ini, so any INI option can be benchmarked with --set, e.g.:
+    python bench.py --sizes 1000,10000 --latency 0.02 --set page_size=250 --set streaming=True
+
+The mock runs in its own process, listening on port 9440, nothing else may be
+listening there. Creating its certificate requires the openssl command.
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+BENCHMARKS = os.path.dirname(os.path.realpath(__file__))
+SCRIPT = os.path.join(os.path.dirname(BENCHMARKS), 'prism_central.py')
+MOCK = os.path.join(BENCHMARKS, 'mock_prism_central.py')
+SCENARIOS = ('list_miss', 'list', 'list_hit', 'all_miss', 'host_hit', 'host_miss')
+
+
+class Benchmark(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='prism-central-bench-')
+        self.cache_path = os.path.join(self.workdir, 'cache')
+        os.mkdir(self.cache_path)
+        shutil.copy(SCRIPT, self.workdir)
+        self.write_settings()
+
+    def write_settings(self):
+        """ prism_central.ini pointing the script at the mock """
+        settings = [
+            ('ip_addr', '127.0.0.1'),
+            ('username', 'admin'),
+            ('password', 'secret'),
+            ('cache_path', self.cache_path),
+            ('cache_max_age', '3600'),
+        ]
+        for option in self.args.set:
+            key, _, value = option.partition('=')
+            settings.append((key.strip(), value.strip()))
+        with open(os.path.join(self.workdir, 'prism_central.ini'), 'w') as ini:
+            ini.write('[prism_central]\n')
+            for key, value in settings:
+                ini.write('%s = %s\n' % (key, value))
+
+    def clear_cache(self):
+        for filename in os.listdir(self.cache_path):
+            os.remove(os.path.join(self.cache_path, filename))
+
+    def run_script(self, *arguments):
+        """ Run the script, returns its wall time in seconds, its peak RSS in MB
+        and the size of its output """
+        with tempfile.TemporaryFile() as output:
+            start = time.time()
+            process = subprocess.Popen([self.args.python, os.path.join(self.workdir, 'prism_central.py')] +
+                                       list(arguments), stdout=output)
+            _, status, usage = os.wait4(process.pid, 0)
+            elapsed = time.time() - start
+            process.returncode = status
+            if status:
+                raise RuntimeError('prism_central.py %s exited with %s' % (' '.join(arguments), status))
+            output.seek(0, os.SEEK_END)
+            return elapsed, usage.ru_maxrss / 1024.0, output.tell()
+
+    def start_mock(self, size):
+        """ Start the mock for an estate of size VMs, once it is listening """
+        mock = subprocess.Popen([sys.executable, MOCK, '--vms', str(size), '--latency', str(self.args.latency)],
+                                stderr=subprocess.PIPE)
+        if not mock.stderr.readline().startswith(b'Serving'):
+            mock.wait()
+            raise RuntimeError('mock_prism_central.py exited with %s' % mock.returncode)
+        return mock
+
+    @staticmethod
+    def mock_stats():
+        """ Requests and bytes sent by the mock since the last call """
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        stats = json.loads(urlopen('https://127.0.0.1:9440/_stats', context=context).read().decode('utf-8'))
+        return sum(requests for requests, _ in stats.values()), sum(sent for _, sent in stats.values())
+
+    def scenario(self, name, size):
+        """ Prepare the cache for a scenario and return the script arguments """
+        # names of the synthetic VMs, see mock_prism_central.Estate
+        host = 'vm-%05d' % (size // 2)
+        if name == 'list_miss':
+            self.clear_cache()
+            return ['--list']
+        if name in ('list', 'list_hit', 'host_hit'):
+            self.clear_cache()
+            self.run_script('--all')
+            self.run_script('--list')
+            return {'list': ['--list'], 'list_hit': ['--list', '--force-cache'], 'host_hit': ['--host', host]}[name]
+        if name == 'all_miss':
+            return ['--all', '--refresh-cache']
+        if name == 'host_miss':
+            self.clear_cache()
+            return ['--host', host]
+
+    def measure(self, size, name):
+        """ Median of the repeated runs of a scenario """
+        runs = []
+        for _ in range(self.args.repeat):
+            arguments = self.scenario(name, size)
+            self.mock_stats()
+            elapsed, rss, output = self.run_script(*arguments)
+            requests, received = self.mock_stats()
+            runs.append({
+                'seconds': elapsed,
+                'peak_rss_mb': rss,
+                'output_bytes': output,
+                'requests': requests,
+                'bytes_received': received,
+            })
+        runs.sort(key=lambda run: run['seconds'])
+        return runs[len(runs) // 2]
+
+    def run(self):
+        results = []
+        try:
+            for size in self.args.sizes:
+                mock = self.start_mock(size)
+                try:
+                    for name in self.args.scenarios:
+                        result = self.measure(size, name)
+                        result.update(vms=size, scenario=name)
+                        results.append(result)
+                        if not self.args.json:
+                            self.report(result)
+                finally:
+                    mock.terminate()
+                    mock.wait()
+        finally:
+            shutil.rmtree(self.workdir)
+        if self.args.json:
+            print(json.dumps(results, indent=2))
+        return results
+
+    @staticmethod
+    def report(result):
+        print('%(vms)7d VMs  %(scenario)-10s %(seconds)8.3fs  %(peak_rss_mb)8.1f MB RSS  '
+              '%(requests)5d requests  %(bytes_received)12d bytes received  %(output_bytes)12d bytes output'
+              % result)
+        sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prism_central.py against a mock PrismCentral')
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        help='Comma separated estate sizes in VMs (default: 1000,10000,50000)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='Comma separated scenarios (default: %s)' % ','.join(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added by the mock to every request (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per scenario, the median is kept (default: 3)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='prism_central.ini option for the benchmarked script (may be repeated)')
+    parser.add_argument('--python', default=sys.executable,
+                        help='Python interpreter running prism_central.py (default: %s)' % sys.executable)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    args.scenarios = args.scenarios.split(',')
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario %s' % name)
+
+    Benchmark(args).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""
+Mock PrismCentral v3 API
+========================
+
+A local HTTPS stand-in for the PrismCentral v3 endpoints used by
+prism_central.py, serving a synthetic estate of any size:
+ - vms/list, clusters/list, projects/list, categories/list, hosts/list
+ - vms/<uuid>
+ - search
+ - groups (VM UUIDs only)
+
+List calls honour length/offset, total_matches, sorting on last_update_time
+and power_state filters. Entities are encoded once at start-up so the mock
+itself stays out of the measurements. Every request can be delayed to mimic
+a remote PrismCentral, and the number of requests and body bytes sent are
+counted per endpoint. Responses are gzip or deflate compressed when the
+request accepts it. GET /_stats returns those counters and resets them.
+
+Run it standalone (it listens on port 9440, like PrismCentral):
+    python mock_prism_central.py --vms 10000 --latency 0.05
+
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+PORT = 9440
+API = '/api/nutanix/v3/'
+# PrismCentral caps the number of entities returned by a list call
+MAX_LENGTH = 500
+SESSION_COOKIE = 'NTNX_IAM_SESSION=mock-session'
+
+CATEGORIES = {
+    'Environment': ['Production', 'Staging', 'Development', 'Test'],
+    'AppType': ['Web', 'Database', 'Cache', 'Queue', 'Batch', 'Monitoring'],
+    'AppTier': ['Frontend', 'Backend', 'Data'],
+    'Owner Team': ['Platform', 'Payments', 'Search', 'Data Science', 'Identity'],
+}
+
+
+class Estate(object):
+    """ Synthetic PrismCentral estate, every entity pre-encoded as JSON """
+
+    def __init__(self, vms, seed=0):
+        rng = random.Random(seed)
+        self.clusters = [self.cluster(rng, i) for i in range(max(1, vms // 2000))]
+        self.nodes = [self.node(rng, i, self.clusters[i % len(self.clusters)]) for i in range(4 * len(self.clusters))]
+        self.projects = [self.project(rng, i) for i in range(10)]
+        self.categories = [{'name': name, 'description': '', 'system_defined': False} for name in CATEGORIES]
+
+        self.vms = []
+        self.vm_index = {}
+        self.search_index = {}
+        for i in range(vms):
+            vm = self.vm(rng, i)
+            self.vm_index[vm['metadata']['uuid']] = len(self.vms)
+            self.search_index[vm['status']['name']] = vm['metadata']['uuid']
+            for nic in vm['status']['resources']['nic_list']:
+                for endpoint in nic['ip_endpoint_list']:
+                    self.search_index.setdefault(endpoint['ip'], vm['metadata']['uuid'])
+            self.vms.append(vm)
+
+        self.encoded = {
+            'vms': [json.dumps(vm).encode('utf-8') for vm in self.vms],
+            'clusters': [json.dumps(cluster).encode('utf-8') for cluster in self.clusters],
+            'hosts': [json.dumps(node).encode('utf-8') for node in self.nodes],
+            'projects': [json.dumps(project).encode('utf-8') for project in self.projects],
+        }
+        self.recent_first = sorted(range(vms), key=lambda i: self.vms[i]['metadata']['last_update_time'],
+                                   reverse=True)
+
+    @staticmethod
+    def reference(kind, name, rng):
+        return {'kind': kind, 'name': name, 'uuid': str(uuid.UUID(int=rng.getrandbits(128)))}
+
+    def vm(self, rng, i):
+        cluster = self.clusters[i % len(self.clusters)]
+        node = self.nodes[i % len(self.nodes)]
+        project = self.projects[rng.randrange(len(self.projects))]
+        categories = {'Environment': rng.choice(CATEGORIES['Environment'])}
+        for name in rng.sample(sorted(CATEGORIES)[1:], rng.randint(1, 3)):
+            categories[name] = rng.choice(CATEGORIES[name])
+        nics = []
+        for n in range(rng.choice((1, 1, 1, 2, 2, 3))):
+            nics.append({
+                'nic_type': 'NORMAL_NIC',
+                'uuid': str(uuid.UUID(int=rng.getrandbits(128))),
+                'mac_address': '50:6b:8d:%02x:%02x:%02x' % (n, (i >> 8) & 0xff, i & 0xff),
+                'subnet_reference': self.reference('subnet', 'vlan%d' % (100 + n), rng),
+                'ip_endpoint_list': [{'ip': '10.%d.%d.%d' % (n, (i // 250) % 250, i % 250 + 1), 'type': 'ASSIGNED'}],
+            })
+        disks = []
+        for n in range(rng.randint(2, 4)):
+            disks.append({
+                'uuid': str(uuid.UUID(int=rng.getrandbits(128))),
+                'disk_size_bytes': rng.choice((20, 50, 100, 500)) * 1024 ** 3,
+                'device_properties': {'device_type': 'DISK',
+                                      'disk_address': {'adapter_type': 'SCSI', 'device_index': n}},
+            })
+        name = 'vm-%05d' % i
+        power_state = 'ON' if rng.random() < 0.9 else 'OFF'
+        resources = {
+            'num_sockets': rng.choice((1, 2, 4)),
+            'num_vcpus_per_socket': 1,
+            'memory_size_mib': rng.choice((2048, 4096, 8192, 16384)),
+            'power_state': power_state,
+            'hypervisor_type': 'AHV',
+            'nic_list': nics,
+            'disk_list': disks,
+            'boot_config': {'boot_device_order_list': ['CDROM', 'DISK', 'NETWORK']},
+        }
+        status_resources = dict(resources, host_reference={'kind': 'host', 'uuid': node['metadata']['uuid'],
+                                                           'name': node['status']['name']})
+        updated = 1500000000 + rng.randrange(30000000)
+        return {
+            'api_version': '3.1',
+            'metadata': {
+                'kind': 'vm',
+                'uuid': str(uuid.UUID(int=i)),
+                'spec_version': rng.randint(0, 20),
+                'creation_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(updated - 86400 * 30)),
+                'last_update_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(updated)),
+                'categories': categories,
+                'project_reference': {'kind': 'project', 'name': project['status']['name'],
+                                      'uuid': project['metadata']['uuid']},
+                'owner_reference': {'kind': 'user', 'name': 'admin', 'uuid': '00000000-0000-0000-0000-000000000000'},
+            },
+            'spec': {
+                'name': name,
+                'cluster_reference': {'kind': 'cluster', 'name': cluster['status']['name'],
+                                      'uuid': cluster['metadata']['uuid']},
+                'resources': resources,
+            },
+            'status': {
+                'name': name,
+                'state': 'COMPLETE',
+                'cluster_reference': {'kind': 'cluster', 'name': cluster['status']['name'],
+                                      'uuid': cluster['metadata']['uuid']},
+                'resources': status_resources,
+            },
+        }
+
+    def cluster(self, rng, i):
+        return {
+            'metadata': {'kind': 'cluster', 'uuid': str(uuid.UUID(int=rng.getrandbits(128)))},
+            'status': {
+                'name': 'cluster%02d' % i,
+                'resources': {
+                    'network': {'external_ip': '10.250.%d.10' % i},
+                    'config': {'software_map': {'NOS': {'software_type': 'NOS', 'version': '5.10.%d' % (i % 5)}}},
+                },
+            },
+        }
+
+    def node(self, rng, i, cluster):
+        return {
+            'metadata': {'kind': 'host', 'uuid': str(uuid.UUID(int=rng.getrandbits(128)))},
+            'status': {
+                'name': 'node%03d' % i,
+                'cluster_reference': {'kind': 'cluster', 'uuid': cluster['metadata']['uuid']},
+                'resources': {'hypervisor': {'ip': '10.251.%d.%d' % (i // 250, i % 250 + 1)}},
+            },
+        }
+
+    def project(self, rng, i):
+        return {
+            'metadata': {'kind': 'project', 'uuid': str(uuid.UUID(int=rng.getrandbits(128)))},
+            'status': {'name': 'project%02d' % i, 'resources': {}},
+        }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, code=200, count=True):
+        """ Send body, a JSON encodable object or bytes """
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        encoding = self.content_encoding() if count else None
+        if encoding:
+            wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+            compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+            body = compressor.compress(body) + compressor.flush()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        if SESSION_COOKIE not in (self.headers.get('Cookie') or ''):
+            self.send_header('Set-Cookie', SESSION_COOKIE + '; Path=/; Secure; HttpOnly')
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.server.count(self.endpoint, len(body))
+
+    def content_encoding(self):
+        """ gzip or deflate when the request accepts it, None otherwise """
+        accepted = [coding.split(';')[0].strip() for coding in (self.headers.get('Accept-Encoding') or '').split(',')]
+        for encoding in ('gzip', 'deflate'):
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def begin(self):
+        """ Common handling of every request, returns the path under the v3 API """
+        self.endpoint = 'unknown'
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.path.startswith(API):
+            return None
+        return self.path[len(API):]
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            return self.reply(self.server.reset_stats(), count=False)
+        path = self.begin()
+        if path and path.startswith('vms/'):
+            self.endpoint = 'vms/<uuid>'
+            index = self.server.estate.vm_index.get(path[4:])
+            if index is not None:
+                return self.reply(self.server.estate.encoded['vms'][index])
+        self.reply({'state': 'ERROR', 'message_list': [{'reason': 'ENTITY_NOT_FOUND'}]}, 404)
+
+    def do_POST(self):
+        path = self.begin()
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except ValueError:
+            return self.reply({'state': 'ERROR'}, 400)
+
+        estate = self.server.estate
+        if path in ('vms/list', 'clusters/list', 'hosts/list', 'projects/list'):
+            self.endpoint = path
+            return self.reply(self.list_page(path.split('/')[0], body))
+        if path == 'categories/list':
+            self.endpoint = path
+            return self.reply({'api_version': '3.1', 'entities': estate.categories,
+                               'metadata': {'kind': 'category', 'total_matches': len(estate.categories)}})
+        if path == 'groups':
+            self.endpoint = path
+            offset = body.get('group_member_offset', 0)
+            count = body.get('group_member_count', 20)
+            uuids = [vm['metadata']['uuid'] for vm in estate.vms[offset:offset + count]]
+            return self.reply({'filtered_entity_count': len(estate.vms),
+                               'group_results': [{'entity_results': [{'entity_id': u} for u in uuids]}]})
+        if path == 'search':
+            self.endpoint = path
+            vm_uuid = estate.search_index.get(body.get('user_query'))
+            tokens = [{'identifier': {'value': vm_uuid}}] if vm_uuid else []
+            return self.reply({'query_term_list': [{'token_list': tokens}] if tokens else []})
+        self.reply({'state': 'ERROR'}, 404)
+
+    def list_page(self, kind, body):
+        """ One page of a list call, assembled from the pre-encoded entities """
+        estate = self.server.estate
+        entities = estate.encoded[kind]
+        indexes = range(len(entities))
+        if kind == 'vms':
+            if body.get('sort_attribute') == 'last_update_time':
+                indexes = estate.recent_first
+                if body.get('sort_order') != 'DESCENDING':
+                    indexes = indexes[::-1]
+            for term in (body.get('filter') or '').split(';'):
+                if term.startswith('power_state=='):
+                    power_state = term.split('==', 1)[1].upper()
+                    indexes = [i for i in indexes
+                               if estate.vms[i]['status']['resources']['power_state'] == power_state]
+        offset = body.get('offset', 0)
+        length = min(body.get('length', 20), MAX_LENGTH)
+        page = [entities[i] for i in list(indexes)[offset:offset + length]]
+        metadata = {'kind': kind.rstrip('s'), 'offset': offset, 'length': len(page),
+                    'total_matches': len(indexes)}
+        return (b'{"api_version": "3.1", "metadata": ' + json.dumps(metadata).encode('utf-8') +
+                b', "entities": [' + b', '.join(page) + b']}')
+
+
+class MockPrismCentral(ThreadingMixIn, HTTPServer):
+    """ HTTPS server answering like PrismCentral for an estate """
+    daemon_threads = True
+
+    def __init__(self, estate, latency=0.0, address='127.0.0.1', port=PORT):
+        HTTPServer.__init__(self, (address, port), MockHandler)
+        self.estate = estate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+        certfile, keyfile = self.self_signed_certificate()
+        context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(certfile, keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    @staticmethod
+    def self_signed_certificate():
+        """ Creates a throwaway certificate with the openssl command """
+        directory = tempfile.mkdtemp(prefix='mock-prism-central-')
+        certfile = os.path.join(directory, 'cert.pem')
+        keyfile = os.path.join(directory, 'key.pem')
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                                   '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                                  stdout=devnull, stderr=devnull)
+        return certfile, keyfile
+
+    def handle_error(self, request, client_address):
+        # the script exits leaving its idle keep-alive connections behind
+        if not isinstance(sys.exc_info()[1], (socket.error, ssl.SSLError)):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def count(self, endpoint, size):
+        with self.lock:
+            requests, sent = self.stats.get(endpoint, (0, 0))
+            self.stats[endpoint] = (requests + 1, sent + size)
+
+    def reset_stats(self):
+        """ Returns the stats counted so far and starts counting again """
+        with self.lock:
+            stats, self.stats = getattr(self, 'stats', {}), {}
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock PrismCentral v3 API serving a synthetic estate')
+    parser.add_argument('--vms', type=int, default=1000, help='Number of VMs (default: 1000)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request (default: 0)')
+    parser.add_argument('--address', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    args = parser.parse_args()
+
+    server = MockPrismCentral(Estate(args.vms), latency=args.latency, address=args.address)
+    sys.stderr.write('Serving %d VMs on https://%s:%d%s\n' % (args.vms, args.address, PORT, API))
+    sys.stderr.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
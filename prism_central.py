@@ -8,16 +8,22 @@ Generates Ansible inventory of PrismCentral AHV VMs.
 In addition to the --list and --host options used by Ansible, there are options
 for generating JSON of other PrismCentral data. This is useful when creating
 VMs. For example, --clusters will return all the PrismCentral Clusters.
-This information can also be easily found in the cache file, whose default
-location is /tmp/ansible-prism_central.cache).
+This information can also be easily found in the cache files, one per
+resource, whose default location is /tmp/ansible-prism_central.*.cache).
 
 The --pretty option pretty-prints the output for better human readability.
 
 ----
-Although the cache stores all the information received from PrismCentral,
-the cache is not used for current VM information (in --list, --host,
---all, and --vms). This is so that accurate VM information is always
-found. You can force this script to use the cache with --force-cache.
+The cache stores all the information received from PrismCentral and is
+used while it is younger than cache_max_age, PrismCentral is called again
+once it expires. --host is answered from the host index written along with
+the inventory, only the variables of that host are read. --refresh-cache
+always calls PrismCentral, --force-cache uses the cache even once expired.
+With incremental_sync enabled in the INI file, the cached VMs are kept and
+only the VMs updated or deleted since the last sync are applied to them.
+Runs started at the same time refresh the cache only once: a lock file next
+to the cache lets one process call PrismCentral while the others wait and
+then read what it cached.
 
 ----
 Configuration is read from `prism_central.ini`, then from environment variables,
@@ -35,6 +41,15 @@ If you specify PrismCentral credentials in the INI file, a handy way to
 get them into your environment (e.g., to use the prism_central module)
 is to use the output of the --env option with export:
     export $(prism_central.py --env)
+With federation regions, the credentials of each region are printed as
+PC_<NAME>_IP_ADDR, PC_<NAME>_USERNAME and PC_<NAME>_PASSWORD instead.
+
+----
+The same inventory is available to Ansible as the prism_central inventory
+plugin: copy this script to an inventory_plugins directory and point Ansible
+at a YAML file ending with prism_central.yml (see EXAMPLES below). The plugin
+keeps the VMs in the configured Ansible cache plugin rather than the cache
+files.
 
 ----
 The following groups are generated from --list:
@@ -47,12 +62,15 @@ The following groups are generated from --list:
  - hypervisor_NAME
  - status_STATUS
  - category_NAME_VALUES
+ - pc_NAME (PrismCentral region, when federating several PrismCentral)
 
 -----
 ```
 usage: prism_central.py [-h] [--list] [--host HOST] [--all] [--vms]
                         [--clusters] [--projects] [--categories] [--nodes]
-                        [--pretty]
+                        [--pretty] [--group PATTERN] [--filter KEY=VALUE]
+                        [--daemon]
+                        [--timings] [--profile FILE]
                         [--cache-path CACHE_PATH]
                         [--cache-max_age CACHE_MAX_AGE] [--force-cache]
                         [--refresh-cache] [--env] [--ip-addr PC_IP_ADDR]
@@ -73,6 +91,20 @@ optional arguments:
   --categories          List Categories as JSON
   --nodes               List Nodes as JSON
   --pretty              Pretty-print results
+  --group PATTERN       With --list, only output the groups matching
+                        PATTERN, a glob, and the variables of their hosts
+                        (may be repeated or comma separated)
+  --filter KEY=VALUE    Only fetch VMs where KEY (power_state, cluster,
+                        project, category, fiql) is one of the comma
+                        separated VALUE (overrides the INI filter_KEY, may
+                        be repeated)
+  --daemon              Keep the inventory in memory and answer --list and
+                        --host over daemon_socket
+  --timings             Report the duration, bytes and entities of each
+                        phase and the cache hits and misses as JSON on
+                        stderr
+  --profile FILE        Profile the run, worker threads included, with
+                        cProfile and dump the stats to FILE
   --cache-path CACHE_PATH
                         Path to the cache files (default: .)
   --cache-max_age CACHE_MAX_AGE
@@ -98,8 +130,106 @@ optional arguments:
 
 ######################################################################
 
+DOCUMENTATION = '''
+    name: prism_central
+    plugin_type: inventory
+    short_description: PrismCentral AHV VMs inventory source
+    description:
+        - Get the AHV VMs of a PrismCentral as inventory hosts, grouped the way prism_central.py --list does.
+        - Uses a YAML configuration file ending with C(prism_central.yml) or C(prism_central.yaml).
+        - The VMs fetched from PrismCentral are kept by the configured Ansible cache plugin, so several
+          controllers can share them through a cache plugin such as redis or memcached.
+    extends_documentation_fragment:
+        - constructed
+        - inventory_cache
+    options:
+        plugin:
+            description: Token that ensures this is a source file for the plugin.
+            required: True
+            choices: ['prism_central']
+        ip_addr:
+            description: PrismCentral IP address.
+            required: True
+            env:
+                - name: PC_IP_ADDR
+        username:
+            description: PrismCentral username.
+            required: True
+            env:
+                - name: PC_USERNAME
+        password:
+            description: PrismCentral password.
+            required: True
+            env:
+                - name: PC_PASSWORD
+        page_size:
+            description: Entities requested per list call.
+            type: int
+            default: 500
+        max_workers:
+            description: List calls run in parallel.
+            type: int
+            default: 4
+        pool_size:
+            description: Idle keep-alive connections kept open.
+            type: int
+            default: 8
+        timeout:
+            description: Timeout of the API calls, in seconds.
+            type: int
+            default: 60
+        retries:
+            description: Retries of a call failing with a timeout, a connection error or a server error.
+            type: int
+            default: 4
+        compression:
+            description: Ask PrismCentral for gzip or deflate compressed responses.
+            type: bool
+            default: True
+        filters:
+            description:
+                - Only get the VMs matching these filters, keyed by power_state, cluster, project, category or
+                  fiql, as the filter_KEY options of prism_central.ini.
+            type: dict
+            default: {}
+        hostvars:
+            description:
+                - Dotted paths into the VM entity to set as host variables, each optionally named with
+                  C(name=path). The whole entity when empty.
+            type: list
+            elements: str
+            default: []
+        pc_namespace:
+            description: Put the host variables in a C(pc_) namespace.
+            type: bool
+            default: False
+        group_variables:
+            description: Variables of the all group.
+            type: dict
+            default: {}
+'''
+
+EXAMPLES = '''
+# prism_central.yml, with prism_central.py copied to an inventory_plugins directory
+plugin: prism_central
+ip_addr: 10.0.0.10
+username: admin
+password: secret
+filters:
+    power_state: 'on'
+hostvars:
+    - name=status.name
+    - cluster=status.cluster_reference.name
+cache: True
+cache_plugin: jsonfile
+cache_connection: /tmp/prism_central_cache
+cache_timeout: 300
+keyed_groups:
+    - key: cluster
+      prefix: cluster
+'''
+
 
-import urllib2
 import base64
 import socket
 import sys
@@ -110,29 +240,367 @@ import argparse
 import ast
 import os
 import re
-
-from time import time
+import random
+import copy
+import errno
+import shutil
+import fnmatch
+import threading
+import calendar
+import gzip
+import zlib
+import hashlib
+import subprocess
+import signal
+import fcntl
+import cProfile
+import pstats
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+from time import time, sleep
 
 try:
     import ConfigParser
 except ImportError:
     import configparser as ConfigParser
 
+try:
+    import httplib
+    import Queue
+    import SocketServer
+except ImportError:
+    import http.client as httplib
+    import queue as Queue
+    import socketserver as SocketServer
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Only Ansible loading the plugin needs Ansible, importing it would cost
+# every script run hundreds of milliseconds
+BaseInventoryPlugin = None
+if __name__ != '__main__':
+    try:
+        from ansible.errors import AnsibleError
+        from ansible.plugins.inventory import BaseInventoryPlugin, Constructable, Cacheable
+    except ImportError:
+        pass
+
 import json
 
 # socket timeout in seconds
 TIMEOUT = 60
-socket.setdefaulttimeout(TIMEOUT)
+# entities requested per list call and number of list calls run in parallel
+PAGE_SIZE = 500
+MAX_WORKERS = 4
+# PrismCentral resources kept in the cache
+RESOURCES = ('vms', 'clusters', 'projects', 'categories', 'nodes')
+# resources the filters never apply to
+UNFILTERED_RESOURCES = ('projects', 'categories', 'nodes')
+# VM filter criteria, as filter_KEY in the INI file or --filter KEY=VALUE
+FILTER_KEYS = ('power_state', 'cluster', 'project', 'category', 'fiql')
+# seconds after which a background refresh that never finished is retried
+REVALIDATE_TIMEOUT = 600
+# gzip level of compressed cache files, favouring speed
+CACHE_COMPRESSLEVEL = 1
+# VM UUIDs requested per groups call by the incremental VM sync
+UUID_PAGE_SIZE = 10000
+# first page of the updated VMs scan of the incremental VM sync, doubled up to
+# page_size while every VM of a page was updated
+SYNC_PAGE_SIZE = 20
+# idle keep-alive connections kept per PrismCentral
+POOL_SIZE = 8
+# retries of a call failing with a timeout, a connection error or a 5xx
+# response, after a random delay of up to RETRY_BACKOFF seconds doubled at
+# each attempt and capped at RETRY_BACKOFF_MAX
+RETRIES = 4
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 30
+# list pages are halved on each retry, down to MIN_PAGE_SIZE entities
+MIN_PAGE_SIZE = 20
+# bytes read from the socket at a time
+READ_CHUNK = 16 * 1024
+# content codings asked for when compression is set
+ACCEPT_ENCODING = 'gzip, deflate'
+# VM references the enrich setting follows: the referenced resource and the
+# path of the reference UUID in the VM entity
+REFERENCES = OrderedDict([
+    ('cluster', ('clusters', ('status', 'cluster_reference', 'uuid'))),
+    ('node', ('nodes', ('status', 'resources', 'host_reference', 'uuid'))),
+    ('project', ('projects', ('metadata', 'project_reference', 'uuid'))),
+])
+# JSON backends by order of preference, json_codec = auto picks the first importable one
+JSON_CODECS = ('orjson', 'ujson', 'json')
 pp = pprint.PrettyPrinter(indent=4)
 
 
+class HTTPStatusError(IOError):
+    """ PrismCentral answered with an error status """
+
+
+class Unreachable(Exception):
+    """ PrismCentral could not be connected to, not worth retrying """
+
+
+class ConnectionPool(object):
+    """ Keep-alive HTTPS connections to PrismCentral, keyed by host """
+
+    def __init__(self, pool_size=POOL_SIZE, port=9440, timeout=TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.port = port
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def idle(self, host):
+        """ Queue of the idle connections to a host """
+        with self.lock:
+            if host not in self.connections:
+                self.connections[host] = Queue.LifoQueue(self.pool_size)
+            return self.connections[host]
+
+    def get(self, host):
+        """ Reuse an idle connection to host or open a new one """
+        try:
+            return self.idle(host).get_nowait()
+        except Queue.Empty:
+            if sys.version_info >= (2, 7, 9):
+                ssl_context = ssl._create_unverified_context()
+                return httplib.HTTPSConnection(host, self.port, timeout=self.timeout, context=ssl_context)
+            return httplib.HTTPSConnection(host, self.port, timeout=self.timeout)
+
+    def release(self, host, connection, response):
+        """ Give a connection back once its response has been read """
+        if response.will_close:
+            connection.close()
+            return
+        try:
+            self.idle(host).put_nowait(connection)
+        except Queue.Full:
+            connection.close()
+
+
+class JsonCodec(object):
+    """ Decodes the API responses and the cache files and encodes the cache
+    files and the output, with orjson or ujson when available and the json
+    standard library otherwise """
+
+    def __init__(self, backend='auto'):
+        modules = {'orjson': orjson, 'ujson': ujson, 'json': json}
+        if backend == 'auto':
+            backend = [name for name in JSON_CODECS if modules[name] is not None][0]
+        elif modules.get(backend) is None:
+            sys.stderr.write('json_codec %s is not available, falling back to json\n' % backend)
+            backend = 'json'
+        self.backend = backend
+
+    def loads(self, data):
+        if self.backend == 'orjson':
+            return orjson.loads(data)
+        if self.backend == 'ujson':
+            return ujson.loads(data)
+        return json.loads(data)
+
+    def load(self, fp):
+        return self.loads(fp.read())
+
+    def encode(self, obj, indent=None, compact=False):
+        """ JSON of obj as bytes. orjson and ujson are always compact, the
+        json standard library only separates items with ',' and keys with ':'
+        when compact is set """
+        if self.backend == 'orjson' and indent in (None, 2):
+            data = orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        elif self.backend == 'ujson':
+            data = ujson.dumps(obj, indent=indent or 0, escape_forward_slashes=False)
+        elif compact:
+            data = json.dumps(obj, indent=indent, separators=(',', ':'))
+        else:
+            data = json.dumps(obj, indent=indent)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return data
+
+    def dump(self, obj, fp, indent=None, compact=False):
+        """ Writes the JSON of obj to the binary file fp and returns its size.
+        The document is encoded in one go, json.dump would go through the
+        much slower pure Python encoder of the json standard library """
+        data = self.encode(obj, indent, compact)
+        fp.write(data)
+        return len(data)
+
+
+class Timings(object):
+    """ Durations, payload bytes and entity counts of the phases of a run,
+    and whether each cache entry was a hit or a miss, reported by --timings.
+    The seconds of phases run by several threads at once are summed """
+
+    def __init__(self):
+        self.started = time()
+        self.phases = OrderedDict()
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """ Times the enclosed block as one call of the phase name """
+        started = time()
+        try:
+            yield
+        finally:
+            self.count(name, calls=1, seconds=time() - started)
+
+    def count(self, name, **counters):
+        """ Adds counters, such as bytes or entities, to the phase name """
+        with self.lock:
+            phase = self.phases.setdefault(name, OrderedDict())
+            for counter, value in counters.items():
+                phase[counter] = phase.get(counter, 0) + value
+
+    def cache_status(self, name, status):
+        """ Records whether the cache entry name was a hit, a miss or expired """
+        with self.lock:
+            self.cache[name] = status
+
+    def report(self):
+        """ Writes the JSON report to stderr """
+        phases = OrderedDict()
+        for name, counters in self.phases.items():
+            phases[name] = OrderedDict((counter, round(value, 6) if isinstance(value, float) else value)
+                                       for counter, value in counters.items())
+        report = OrderedDict([('seconds', round(time() - self.started, 6)),
+                              ('phases', phases),
+                              ('cache', self.cache)])
+        sys.stderr.write(json.dumps(report, indent=2) + '\n')
+
+
+class ResponseReader(object):
+    """ File-like reader of a response body, decompressed as it is read
+    when PrismCentral sent it gzip or deflate encoded. Counts the bytes
+    received and the bytes they decoded to """
+
+    def __init__(self, response):
+        self.response = response
+        self.encoding = (response.getheader('content-encoding') or '').strip().lower()
+        if self.encoding in ('gzip', 'x-gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self.decompressor = zlib.decompressobj()
+        else:
+            self.decompressor = None
+        self.pending = b''
+        self.finished = False
+        self.received = 0
+        self.decoded = 0
+
+    def read(self, size=-1):
+        """ Up to size decoded bytes, the whole remaining body by default """
+        if self.decompressor is None:
+            data = self.response.read() if size is None or size < 0 else self.response.read(size)
+            self.received += len(data)
+            self.decoded += len(data)
+            return data
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(READ_CHUNK), b''))
+        if not size:
+            return b''
+        while not self.finished:
+            if not self.pending:
+                self.pending = self.response.read(READ_CHUNK)
+                self.received += len(self.pending)
+                if not self.pending:
+                    self.finished = True
+                    data = self.decompressor.flush()
+                    self.decoded += len(data)
+                    return data
+            try:
+                data = self.decompressor.decompress(self.pending, size)
+            except zlib.error:
+                # Some servers send deflate without its zlib header
+                if self.encoding != 'deflate' or self.decoded:
+                    raise
+                self.encoding = 'raw deflate'
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = self.decompressor.decompress(self.pending, size)
+            self.pending = self.decompressor.unconsumed_tail
+            if data:
+                self.decoded += len(data)
+                return data
+        return b''
+
+    def count(self, timings):
+        """ Adds the bytes received, and saved by compression, to the read phase """
+        timings.count('read', bytes=self.received, bytes_saved=self.decoded - self.received)
+
+
+class Profiler(object):
+    """ cProfile of the run, including the threads it starts such as the
+    workers fetching list pages and resources. Each thread gets its own
+    profile, merged into one when dumped """
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.setprofile(self.profile_thread)
+        self.profile_thread()
+
+    def profile_thread(self, *args):
+        """ Called first thing by every new thread, replaces itself with a profile """
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def dump(self, filename):
+        """ Stops profiling and writes the merged stats of all the threads to filename """
+        threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.profiles)
+        profiles[0].disable()
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(filename)
+
+
 class PcManager():
 
-    def __init__(self, ip_addr, username, password):
+    def __init__(self, ip_addr, username, password,
+                 page_size=PAGE_SIZE, max_workers=MAX_WORKERS, pool_size=POOL_SIZE, timeout=TIMEOUT,
+                 retries=RETRIES, compression=True, timings=None, codec=None):
         # Initialise the options.
         self.ip_addr = ip_addr
         self.username = username
         self.password = password
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.retries = retries
+        self.compression = compression
+        credentials = base64.b64encode(('%s:%s' % (username, password)).encode('utf-8'))
+        self.auth_header = "Basic %s" % credentials.decode('ascii')
+        # Shared by the per-request copies made in call()
+        self.pool = ConnectionPool(pool_size, timeout=timeout)
+        self.session = {}
+        self.timings = timings or Timings()
+        self.codec = codec or JsonCodec()
         self.rest_params_init()
 
     # Initialize REST API parameters
@@ -143,104 +611,393 @@ class PcManager():
         self.method = method
         self.content_type = content_type
         self.response_file = response_file
+        # Why the last call failed when it is worth retrying, None otherwise,
+        # and whether PrismCentral seemed overloaded, so pages should shrink
+        self.retry_error = None
+        self.overloaded = False
 
     # Create a REST client session.
     def rest_call(self):
-        base_url = 'https://%s:9440/api/nutanix/v3/%s' % (
-            self.ip_addr, self.sub_url)
+        url = '/api/nutanix/v3/%s' % self.sub_url
         if self.body and self.content_type == "application/json":
             self.body = json.dumps(self.body)
-        request = urllib2.Request(base_url, data=self.body)
-        base64string = base64.encodestring(
-            '%s:%s' %
-            (self.username, self.password)).replace(
-            '\n', '')
-        request.add_header("Authorization", "Basic %s" % base64string)
-
-        request.add_header(
-            'Content-Type',
-            '%s; charset=utf-8' %
-            self.content_type)
-        request.get_method = lambda: self.method
 
         try:
-            if sys.version_info >= (2, 7, 5):
-                ssl_context = ssl._create_unverified_context()
-                response = urllib2.urlopen(request, context=ssl_context)
-            else:
-                response = urllib2.urlopen(request)
+            connection, response = self.send_request(url)
+            if response.status >= 400:
+                err_result = ResponseReader(response).read()
+                self.pool.release(self.ip_addr, connection, response)
+                error = "HTTP Error %s: %s" % (response.status, response.reason)
+                if PcManager.is_retryable(response.status):
+                    self.retry_error = error
+                    self.overloaded = True
+                if err_result:
+                    try:
+                        err_result = self.codec.loads(err_result)
+                    except ValueError:
+                        return "408", error
+                return "408", err_result or error
             result = ""
-            if self.response_file:
-                chunk = 16 * 1024
-                with open(self.response_file, "wb") as of:
-                    while True:
-                        content = response.read(chunk)
-                        if not content:
-                            break
-                        of.write(content)
-            else:
-                result = response.read()
-                if result:
-                    result = json.loads(result)
+            reader = ResponseReader(response)
+            with self.timings.phase('read'):
+                if self.response_file:
+                    with open(self.response_file, "wb") as of:
+                        while True:
+                            content = reader.read(READ_CHUNK)
+                            if not content:
+                                break
+                            of.write(content)
+                else:
+                    result = reader.read()
+            reader.count(self.timings)
+            self.pool.release(self.ip_addr, connection, response)
+            if result:
+                with self.timings.phase('decode'):
+                    result = self.codec.loads(result)
+                if isinstance(result, dict) and isinstance(result.get('entities'), list):
+                    self.timings.count('decode', entities=len(result['entities']))
             return result
-        except urllib2.HTTPError as e:
-            err_result = e.read()
-            if err_result:
-                try:
-                    err_result = json.loads(err_result)
-                except:
-                    print "Error: %s" % e
-                    return "408", None
-            return "408", err_result
         except Exception as e:
-            print "Error: %s" % e
-            return "408", None
+            if isinstance(e, (httplib.HTTPException, socket.error)):
+                self.retry_error = str(e) or e.__class__.__name__
+                self.overloaded = PcManager.is_timeout(e)
+            return "408", str(e)
+
+    def stream_call(self, prefix):
+        """ Like rest_call, but yields the items found at prefix (an ijson
+        prefix such as 'entities.item') as they are decoded from the socket,
+        so only one item is held in memory at a time. The other scalar values
+        of the response are kept in self.stream_values by prefix """
+        url = '/api/nutanix/v3/%s' % self.sub_url
+        if self.body and self.content_type == "application/json":
+            self.body = json.dumps(self.body)
 
-    def list_vms(self):
-        body = {
-            "length": 15000,
-            "offset": 0,
-            "filter": ""
-        }
-        self.rest_params_init(sub_url="vms/list", method="POST", body=body)
-        return self.rest_call()
+        self.stream_values = {}
+        connection, response = self.send_request(url)
+        if response.status >= 400:
+            response.read()
+            self.pool.release(self.ip_addr, connection, response)
+            error = "HTTP Error %s: %s" % (response.status, response.reason)
+            if PcManager.is_retryable(response.status):
+                self.retry_error = error
+                self.overloaded = True
+            raise HTTPStatusError(error)
+
+        reader = ResponseReader(response)
+        released = False
+        try:
+            events = ijson.parse(reader)
+            for current, event, value in events:
+                if current == prefix and event in ('start_map', 'start_array'):
+                    builder = ijson.common.ObjectBuilder()
+                    end_event = event.replace('start', 'end')
+                    while (current, event) != (prefix, end_event):
+                        # ijson decodes non integer numbers as Decimal
+                        if isinstance(value, Decimal):
+                            value = float(value)
+                        builder.event(event, value)
+                        current, event, value = next(events)
+                    yield builder.value
+                elif current == prefix:
+                    yield value
+                elif event in ('string', 'number', 'boolean', 'null'):
+                    self.stream_values[current] = value
+            # The read phase is not timed, reading and decoding are interleaved
+            reader.count(self.timings)
+            self.pool.release(self.ip_addr, connection, response)
+            released = True
+        finally:
+            # A body left half read, on an error or when the caller stops
+            # early, leaves the connection unusable
+            if not released:
+                connection.close()
+
+    def send_request(self, url):
+        """ Send the current request over a pooled keep-alive connection.
+        Once PrismCentral hands out a session cookie it is used instead of
+        Basic auth. A reused connection the server has closed in the meantime,
+        or an expired session, is retried once """
+        while True:
+            connection = self.pool.get(self.ip_addr)
+            reused = connection.sock is not None
+            headers = {'Content-Type': '%s; charset=utf-8' % self.content_type}
+            if self.compression:
+                headers['Accept-Encoding'] = ACCEPT_ENCODING
+            cookie = self.session.get('cookie')
+            if cookie:
+                headers['Cookie'] = cookie
+            else:
+                headers['Authorization'] = self.auth_header
+            if not reused:
+                with self.timings.phase('connect'):
+                    try:
+                        connection.connect()
+                    except socket.error as e:
+                        # Retrying an unreachable PrismCentral would only
+                        # stall the run, or its region, for another timeout
+                        connection.close()
+                        if PcManager.is_timeout(e):
+                            raise Unreachable('Timed out connecting to %s' % self.ip_addr)
+                        if e.errno in (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH):
+                            raise Unreachable('Could not connect to %s: %s' % (self.ip_addr, e))
+                        raise
+            try:
+                with self.timings.phase('request'):
+                    connection.request(self.method, url, self.body, headers)
+                    response = connection.getresponse()
+                self.timings.count('request', bytes=len(self.body or ''))
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                if reused and PcManager.is_closed_connection(e):
+                    continue
+                raise
+            if response.status == 401 and cookie:
+                response.read()
+                self.pool.release(self.ip_addr, connection, response)
+                self.session.pop('cookie', None)
+                continue
+            self.update_session(response)
+            return connection, response
+
+    def update_session(self, response):
+        """ Remember the session cookies set by PrismCentral """
+        if hasattr(response.msg, 'get_all'):
+            headers = response.msg.get_all('set-cookie') or []
+        else:
+            headers = response.msg.getheaders('set-cookie')
+        cookies = [header.split(';', 1)[0].strip() for header in headers]
+        if cookies:
+            self.session['cookie'] = '; '.join(cookies)
+
+    def list_page(self, sub_url, offset, length, filter="",
+                  sort_attribute=None, sort_order=None):
+        """ Fetch a single page of a v3 list endpoint. A page failing with a
+        timeout or a server error is retried with half the length each time,
+        so the page returned may hold fewer entities than requested. Other
+        connection errors are retried with the same length """
+        attempt = 0
+        while True:
+            body = {
+                "length": length,
+                "offset": offset,
+                "filter": filter
+            }
+            if sort_attribute:
+                body["sort_attribute"] = sort_attribute
+                body["sort_order"] = sort_order
+            result, error, overloaded = self.call(sub_url, "POST", body)
+            if error is None or attempt == self.retries:
+                return result
+            if overloaded:
+                length = max(MIN_PAGE_SIZE, length // 2)
+            self.backoff(sub_url, error, attempt, length)
+            attempt += 1
+
+    def stream_entities(self, sub_url, filter=""):
+        """ Yield the entities of a v3 list endpoint one at a time, decoding
+        them while they are read. Pages are requested one after the other.
+        A page failing with a timeout or a server error is requested again,
+        with half the length, from the entity after the last one yielded.
+        Other connection errors request it again with the same length """
+        offset = 0
+        length = self.page_size
+        attempt = 0
+        while True:
+            body = {
+                "length": length,
+                "offset": offset,
+                "filter": filter
+            }
+            manager = copy.copy(self)
+            manager.rest_params_init(sub_url=sub_url, method="POST", body=body)
+            count = 0
+            try:
+                for entity in manager.stream_call('entities.item'):
+                    count += 1
+                    yield entity
+            except (httplib.HTTPException, IOError) as e:
+                # Error statuses are retried only when retry_error says so,
+                # on Python 3 HTTPStatusError is a socket.error as well
+                retryable = manager.retry_error or (isinstance(e, (httplib.HTTPException, socket.error)) and
+                                                    not isinstance(e, HTTPStatusError))
+                if not retryable or attempt == self.retries:
+                    raise
+                offset += count
+                if manager.overloaded or PcManager.is_timeout(e):
+                    length = max(MIN_PAGE_SIZE, length // 2)
+                self.backoff(sub_url, manager.retry_error or e, attempt, length)
+                attempt += 1
+                continue
+            offset += count
+            if not count or offset >= manager.stream_values.get('metadata.total_matches', 0):
+                return
+
+    def call(self, sub_url, method, body=None):
+        """ Run a single REST call, returns its result, why it failed when
+        it is worth retrying and whether PrismCentral seemed overloaded.
+        rest_call keeps the request on the instance, so every call gets its
+        own shallow copy to be safe to run from a worker thread """
+        manager = copy.copy(self)
+        manager.rest_params_init(sub_url=sub_url, method=method, body=body)
+        result = manager.rest_call()
+        return result, manager.retry_error, manager.overloaded
+
+    def request(self, sub_url, method, body=None):
+        """ Run a REST call, retried with backoff after a timeout, a
+        connection error or a server error """
+        attempt = 0
+        while True:
+            result, error, _ = self.call(sub_url, method, body)
+            if error is None or attempt == self.retries:
+                return result
+            self.backoff(sub_url, error, attempt)
+            attempt += 1
+
+    def backoff(self, sub_url, error, attempt, length=None):
+        """ Report a failed attempt on stderr and wait before the next one,
+        a random delay so parallel calls don't all retry at once """
+        delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+        retry = 'retrying in %.1fs' % delay
+        if length:
+            retry += ' with %d entities per page' % length
+        sys.stderr.write('Error calling %s on %s: %s, %s (%d/%d)\n'
+                         % (sub_url, self.ip_addr, error, retry, attempt + 1, self.retries))
+        self.timings.count('retries', calls=1, seconds=delay)
+        sleep(delay)
 
-    def list_clusters(self):
-        body = {
-            "length": 1000,
-            "offset": 0,
-            "filter": ""
-        }
-        self.rest_params_init(sub_url="clusters/list", method="POST", body=body)
-        return self.rest_call()
+    @staticmethod
+    def is_retryable(status):
+        """ Whether a call answered with the HTTP status is worth retrying """
+        return status >= 500 or status == 429
+
+    @staticmethod
+    def is_timeout(error):
+        """ Whether error is a timeout, Python 2 reports a TLS handshake
+        timeout as an SSLError """
+        return isinstance(error, socket.timeout) or (isinstance(error, ssl.SSLError) and 'timed out' in str(error))
+
+    @staticmethod
+    def is_closed_connection(error):
+        """ Whether error means the server closed a keep-alive connection,
+        as opposed to a timeout, which is left to the retries """
+        # RemoteDisconnected is a BadStatusLine
+        if isinstance(error, httplib.BadStatusLine):
+            return True
+        # A TLS connection closed by the server ends with an unexpected EOF
+        if isinstance(error, ssl.SSLError):
+            return 'eof' in str(error).lower()
+        return isinstance(error, socket.error) and error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+    def list_entities(self, sub_url, filter=""):
+        """ Fetch all the entities of a v3 list endpoint.
+        The first page tells how many entities there are, the remaining
+        pages are then requested concurrently and merged in offset order """
+        first = self.list_page(sub_url, 0, self.page_size, filter)
+        if not isinstance(first, dict):
+            return first
+
+        entities = first.get('entities', [])
+        total = first.get('metadata', {}).get('total_matches', len(entities))
+        # Prism Central may cap the page length below what was requested,
+        # or the first page may have been shrunk by a retry
+        length = len(entities) or self.page_size
+        offsets = range(len(entities), total, length)
+        if offsets:
+            pool = ThreadPool(min(self.max_workers, len(offsets)))
+            try:
+                pages = pool.map(lambda offset: self.list_range(sub_url, offset, min(offset + length, total), filter),
+                                 offsets)
+            finally:
+                pool.close()
+                pool.join()
+            for page in pages:
+                if not isinstance(page, list):
+                    return page
+                entities.extend(page)
+
+        first['entities'] = entities
+        if 'metadata' in first:
+            first['metadata']['offset'] = 0
+            first['metadata']['length'] = len(entities)
+        return first
+
+    def list_range(self, sub_url, offset, end, filter=""):
+        """ Fetch the entities of a v3 list endpoint from offset up to end.
+        A page shrunk by a retry comes back short, the next pages then resume
+        from the entity after the last one received, at the shrunk length """
+        entities = []
+        length = end - offset
+        while offset < end:
+            page = self.list_page(sub_url, offset, min(length, end - offset), filter)
+            if not isinstance(page, dict):
+                return page
+            if not page.get('entities'):
+                break
+            entities.extend(page['entities'])
+            offset += len(page['entities'])
+            length = len(page['entities'])
+        return entities
+
+    def list_vms(self, filter=""):
+        return self.list_entities("vms/list", filter)
+
+    def list_vms_since(self, timestamp):
+        """ List the VMs updated at or after timestamp (seconds since the epoch).
+        VMs are requested most recently updated first, so paging stops at the
+        first VM older than timestamp. Pages start small, as few VMs change
+        between two syncs, and grow while every VM of a page was updated """
+        entities = []
+        length = min(SYNC_PAGE_SIZE, self.page_size)
+        while True:
+            page = self.list_page("vms/list", len(entities), length,
+                                  sort_attribute="last_update_time", sort_order="DESCENDING")
+            if not isinstance(page, dict):
+                return page
+            for vm in page.get('entities', []):
+                if PcManager.last_update_time(vm) < timestamp:
+                    return entities
+                entities.append(vm)
+            if not page.get('entities') or len(entities) >= page['metadata']['total_matches']:
+                return entities
+            length = min(length * 2, self.page_size)
+
+    def list_vm_uuids(self):
+        """ List the UUIDs of all the VMs. The groups API only returns the
+        requested attributes, so this is much lighter than vms/list """
+        uuids = []
+        while True:
+            body = {
+                "entity_type": "mh_vm",
+                "group_member_attributes": [{"attribute": "vm_name"}],
+                "group_member_count": UUID_PAGE_SIZE,
+                "group_member_offset": len(uuids)
+            }
+            result = self.request("groups", "POST", body)
+            if not isinstance(result, dict):
+                return result
+            page = [entity['entity_id']
+                    for group in result.get('group_results', [])
+                    for entity in group.get('entity_results', [])]
+            uuids.extend(page)
+            if not page or len(uuids) >= result.get('filtered_entity_count', 0):
+                return uuids
+
+    def list_clusters(self, filter=""):
+        return self.list_entities("clusters/list", filter)
 
     def list_projects(self):
-        body = {
-            "length": 1000,
-            "offset": 0,
-            "filter": ""
-        }
-        self.rest_params_init(sub_url="projects/list", method="POST", body=body)
-        return self.rest_call()
+        return self.list_entities("projects/list")
 
     def list_categories(self):
         body = {}
-        self.rest_params_init(sub_url="categories/list", method="POST", body=body)
-        return self.rest_call()
+        return self.request("categories/list", "POST", body)
 
     def list_nodes(self):
-        body = {
-            "length": 15000,
-            "offset": 0,
-            "filter": ""
-        }
-        self.rest_params_init(sub_url="hosts/list", method="POST", body=body)
-        return self.rest_call()
+        return self.list_entities("hosts/list")
 
     def get_vm(self, vm_uuid):
         sub_url = 'vms/%s' % vm_uuid
-        self.rest_params_init(sub_url=sub_url, method="GET")
-        return self.rest_call()
+        return self.request(sub_url, "GET")
 
     def search(self, user_query):
         body = {
@@ -249,8 +1006,30 @@ class PcManager():
             "generate_autocompletions_only": True,
             "is_autocomplete_selection": False
         }
-        self.rest_params_init(sub_url="search", method="POST", body=body)
-        return self.rest_call()
+        return self.request("search", "POST", body)
+
+    @staticmethod
+    def last_update_time(entity):
+        """ Seconds since the epoch of the entity metadata.last_update_time """
+        timestamp = entity['metadata'].get('last_update_time')
+        if not timestamp:
+            return 0
+        return calendar.timegm(datetime.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S').timetuple())
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+    """ Answers the --list or --host request of a client of the daemon """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        self.wfile.write(self.server.inventory.daemon_answer(request))
+
+
+class DaemonServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
 
 class PrismCentralInventory(object):
 
@@ -258,95 +1037,225 @@ class PrismCentralInventory(object):
     # Main execution path
     ###########################################################################
 
-    def __init__(self):
-        """Main execution path """
+    def __init__(self, run=True):
+        """Main execution path. With run False only the defaults are set, for
+        the inventory plugin to reuse the inventory building """
 
         # PrismCentralInventory data
         self.data = {}  # All PrismCentral data
         self.inventory = {}  # Ansible Inventory
+        self.sync = {}  # Last sync timestamp of each resource
+        self.groups = {}  # Hosts of each inventory group, as ordered sets
+        self.group_names = {}  # Memoized group names
+        self.host_index = {'keys': {}, 'uuids': {}, 'regions': {}}  # Hosts by VM UUID, name and IP
+        self.references = {}  # Referenced clusters, nodes and projects by UUID
 
         # Define defaults
         self.cache_path = '.'
         self.cache_max_age = 0
+        self.cache_max_ages = {}
+        self.cache_compress = False
+        self.stale_while_revalidate = False
+        self.cache_max_stale = 0
+        self.cache_output = False
+        self.cache_group_index = False
+        self.group_patterns = []
+        self.group_index = {}  # Groups of the inventory, for --group
+        self.hostvars_data = b''  # Encoded variables of each host, see build_hostvars
+        self.groups_data = b''  # Encoded hosts and variables of each group, see build_group_index
+        self.output = None  # --list output as bytes, once encoded
+        self.cache_lock = None  # Lock file of the cache refresh, while held
+        self.lock_waited = None  # When the wait for the cache lock started
+        self.daemon_socket = None
+        self.daemon_refresh = 300
         self.group_variables = {}
+        self.page_size = PAGE_SIZE
+        self.max_workers = MAX_WORKERS
+        self.pool_size = POOL_SIZE
+        self.retries = RETRIES
+        self.compression = True
+        self.incremental_sync = False
+        self.streaming = False
+        self.hostvars = []
+        self.enrich = OrderedDict()
+        self.pc_namespace_vars = False
+        self.filter_criteria = {}
+        self.timeout = TIMEOUT
+        self.region_settings = OrderedDict()
+        self.region_name = None
+        self.regions = []
+        self.timings = Timings()
+        self.json_codec = 'auto'
+
+        if not run:
+            return
 
         # Read settings, environment variables, and CLI arguments
         self.read_settings()
         self.read_environment()
         self.read_cli_args()
+        self.build_filters()
+        self.codec = JsonCodec(self.json_codec)
+
+        # A PrismCentral given in the environment or on the command line
+        # takes over the federation regions of the INI file
+        if os.getenv("PC_IP_ADDR") or self.args.ip_addr:
+            self.region_settings.clear()
+
+        # Verify every federation region is complete
+        for name, settings in self.region_settings.items():
+            for option in ('ip_addr', 'username', 'password'):
+                if not settings.get(option):
+                    sys.stderr.write('Could not find a value for %s of PrismCentral region %s in the ini file\n'
+                                     % (option, name))
+                    sys.exit(-1)
 
         # Verify Prism Central IP was set
-        if not hasattr(self, 'ip_addr'):
+        if not self.region_settings and not hasattr(self, 'ip_addr'):
             msg = 'Could not find values for PrismCentral ip_addr. They must be specified via either ini file, ' \
                   'command line argument (--ip-addr, -i), or environment variables (PC_IP_ADDR)\n'
             sys.stderr.write(msg)
             sys.exit(-1)
 
         # Verify credentials were set
-        if not hasattr(self, 'username'):
+        if not self.region_settings and not hasattr(self, 'username'):
             msg = 'Could not find values for PrismCentral username. They must be specified via either ini file, ' \
                   'command line argument (--username, -u), or environment variables (PC_USERNAME)\n'
             sys.stderr.write(msg)
             sys.exit(-1)
-        if not hasattr(self, 'password'):
+        if not self.region_settings and not hasattr(self, 'password'):
             msg = 'Could not find values for PrismCentral password. They must be specified via either ini file, ' \
                   'command line argument (--password, -p), or environment variables (PC_PASSWORD)\n'
             sys.stderr.write(msg)
             sys.exit(-1)
 
-        # env command, show PrismCentral credentials
+        # env command, show PrismCentral credentials, as PC_<NAME>_* for each region when federated
         if self.args.env:
-            print("PC_IP_ADDR=%s" % self.ip_addr)
-            print("PC_USERNAME=%s" % self.username)
-            print("PC_PASSWORD=%s" % self.password)
+            regions = [('PC_%s_' % name.upper(), settings) for name, settings in self.region_settings.items()] or [
+                ('PC_', {'ip_addr': self.ip_addr, 'username': self.username, 'password': self.password})]
+            for prefix, settings in regions:
+                print("%sIP_ADDR=%s" % (prefix, settings['ip_addr']))
+                print("%sUSERNAME=%s" % (prefix, settings['username']))
+                print("%sPASSWORD=%s" % (prefix, settings['password']))
             sys.exit(0)
 
-        # Manage cache
-        self.cache_filename = self.cache_path + "/ansible-prism_central.cache"
-        self.cache_refreshed = False
+        if self.args.profile:
+            profiler = Profiler()
+            profiler.start()
+        try:
+            self.run_command()
+        finally:
+            if self.args.profile:
+                profiler.dump(self.args.profile)
+            if self.args.timings:
+                self.timings.report()
+
+    def run_command(self):
+        """ Run the command given on the command line and print its JSON """
+
+        # Copy the cached --list output as is while it is valid, the daemon
+        # still has to start and serve it
+        cached_list = self.args.list and not self.args.daemon
+        if cached_list and self.cache_output and not self.group_patterns and self.emit_cached_output():
+            return
+
+        # Answer --list --group from the cached group index while it is valid
+        if cached_list and self.cache_group_index and self.group_patterns and self.emit_group_subset():
+            return
 
-        if self.is_cache_valid():
-            self.load_from_cache()
-            if len(self.data) == 0:
-                if self.args.force_cache:
-                    sys.stderr.write('Cache is empty and --force-cache was specified\n')
-                    sys.exit(-1)
+        # Answer --list and --host from a running daemon when there is one
+        if (self.daemon_socket and not self.args.daemon and (self.args.list or self.args.host) and
+                not self.group_patterns and
+                not (self.args.force_cache or self.args.refresh_cache or self.args.revalidate)):
+            answer = self.ask_daemon()
+            if answer:
+                getattr(sys.stdout, 'buffer', sys.stdout).write(answer)
+                return
+
+        # Manage cache, entries are only loaded once needed
+        self.cache_refreshed = set()
+
+        if self.region_settings:
+            self.manager = None
+            self.regions = [self.region(name, settings) for name, settings in self.region_settings.items()]
+        else:
+            self.manager = PcManager(self.ip_addr, self.username, self.password,
+                                     page_size=self.page_size, max_workers=self.max_workers,
+                                     pool_size=self.pool_size, timeout=self.timeout, retries=self.retries,
+                                     compression=self.compression, timings=self.timings, codec=self.codec)
 
-        self.manager = PcManager(self.ip_addr, self.username, self.password)
+        if self.args.daemon:
+            self.run_daemon()
+            return
 
         # Pick the json_data to print based on the CLI command
         if self.args.vms:
-            self.load_from_prism_central('vms')
+            self.load_data('vms')
             json_data = {'vms': self.data['vms']}
         elif self.args.clusters:
-            self.load_from_prism_central('clusters')
+            self.load_data('clusters')
             json_data = {'clusters': self.data['clusters']}
         elif self.args.projects:
-            self.load_from_prism_central('projects')
+            self.load_data('projects')
             json_data = {'projects': self.data['projects']}
         elif self.args.categories:
-            self.load_from_prism_central('categories')
+            self.load_data('categories')
             json_data = {'categories': self.data['categories']}
         elif self.args.nodes:
-            self.load_from_prism_central('nodes')
+            self.load_data('nodes')
             json_data = {'nodes': self.data['nodes']}
         elif self.args.all:
-            self.load_from_prism_central()
+            self.load_data()
             json_data = self.data
         elif self.args.host:
             json_data = self.load_vm_variables_for_host()
         else:    # '--list' this is last to make it default
-            self.load_from_prism_central('vms')
-            self.build_inventory()
+            if self.load_cached_inventory():
+                pass
+            elif self.can_stream_vms():
+                self.stream_inventory()
+            else:
+                self.load_data('vms')
+                if not isinstance(self.data.get('vms'), dict):
+                    sys.stderr.write('Could not get the VMs from PrismCentral %s\n' % self.ip_addr)
+                    sys.exit(-1)
+                # Unless the process that refreshed the VMs built it already
+                if not (self.refreshed_elsewhere('vms') and self.refreshed_elsewhere('inventory') and
+                        self.load_from_cache('inventory')):
+                    self.build_inventory()
+                if 'vms' in self.cache_refreshed or any('vms' in region.cache_refreshed for region in self.regions):
+                    self.refresh_host_index()
             json_data = self.inventory
+            if self.cache_output and 'inventory' in self.cache_refreshed:
+                self.output = self.codec.encode(self.inventory) + b'\n'
+                self.cache_refreshed.add('output')
+            if self.cache_group_index and 'inventory' in self.cache_refreshed:
+                self.build_group_index()
+                self.cache_refreshed.update(['group_index', 'groups'])
+            if self.group_patterns:
+                json_data = self.group_subset(self.inventory)
 
         if self.cache_refreshed:
             self.write_to_cache()
+        self.unlock_cache()
+
+        # A background refresh has nobody to print to
+        if self.args.revalidate:
+            try:
+                os.remove(self.cache_file('inventory') + '.revalidating')
+            except OSError:
+                pass
+            return
 
-        if self.args.pretty:
-            print(json.dumps(json_data, indent=2))
-        else:
-            print(json.dumps(json_data))
+        with self.timings.phase('output'):
+            if self.args.pretty:
+                output = self.codec.encode(json_data, indent=2) + b'\n'
+            elif json_data is self.inventory and self.output is not None:
+                output = self.output
+            else:
+                output = self.codec.encode(json_data) + b'\n'
+            getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+        self.timings.count('output', bytes=len(output))
 
     ###########################################################################
     # Script configuration
@@ -373,11 +1282,90 @@ class PrismCentralInventory(object):
             self.cache_path = config.get('prism_central', 'cache_path')
         if config.has_option('prism_central', 'cache_max_age'):
             self.cache_max_age = config.getint('prism_central', 'cache_max_age')
+        for name in RESOURCES:
+            if config.has_option('prism_central', 'cache_max_age_' + name):
+                self.cache_max_ages[name] = config.getint('prism_central', 'cache_max_age_' + name)
+        if config.has_option('prism_central', 'cache_compress'):
+            self.cache_compress = config.getboolean('prism_central', 'cache_compress')
+        if config.has_option('prism_central', 'stale_while_revalidate'):
+            self.stale_while_revalidate = config.getboolean('prism_central', 'stale_while_revalidate')
+        if config.has_option('prism_central', 'cache_max_stale'):
+            self.cache_max_stale = config.getint('prism_central', 'cache_max_stale')
+        if config.has_option('prism_central', 'cache_output'):
+            self.cache_output = config.getboolean('prism_central', 'cache_output')
+        if config.has_option('prism_central', 'cache_group_index'):
+            self.cache_group_index = config.getboolean('prism_central', 'cache_group_index')
+
+        # API paging
+        if config.has_option('prism_central', 'page_size'):
+            self.page_size = config.getint('prism_central', 'page_size')
+        if config.has_option('prism_central', 'max_workers'):
+            self.max_workers = config.getint('prism_central', 'max_workers')
+        if config.has_option('prism_central', 'pool_size'):
+            self.pool_size = config.getint('prism_central', 'pool_size')
+        if config.has_option('prism_central', 'retries'):
+            self.retries = config.getint('prism_central', 'retries')
+        if config.has_option('prism_central', 'compression'):
+            self.compression = config.getboolean('prism_central', 'compression')
+
+        # Incremental VM sync
+        if config.has_option('prism_central', 'incremental_sync'):
+            self.incremental_sync = config.getboolean('prism_central', 'incremental_sync')
+
+        # Streaming decode of the VM list
+        if config.has_option('prism_central', 'streaming'):
+            self.streaming = config.getboolean('prism_central', 'streaming')
+
+        # JSON backend
+        if config.has_option('prism_central', 'json_codec'):
+            self.json_codec = config.get('prism_central', 'json_codec')
+
+        # Server side filters
+        for key in FILTER_KEYS:
+            if config.has_option('prism_central', 'filter_' + key):
+                self.filter_criteria[key] = config.get('prism_central', 'filter_' + key)
+
+        # Host variables
+        if config.has_option('prism_central', 'hostvars'):
+            self.hostvars = PrismCentralInventory.compile_hostvars(config.get('prism_central', 'hostvars'))
+        if config.has_option('prism_central', 'pc_namespace'):
+            self.pc_namespace_vars = config.getboolean('prism_central', 'pc_namespace')
+        if config.has_option('prism_central', 'enrich'):
+            self.enrich = PrismCentralInventory.compile_enrich(config.get('prism_central', 'enrich'))
 
         # Group variables
         if config.has_option('prism_central', 'group_variables'):
             self.group_variables = ast.literal_eval(config.get('prism_central', 'group_variables'))
 
+        # Daemon mode
+        if config.has_option('prism_central', 'daemon_socket'):
+            self.daemon_socket = config.get('prism_central', 'daemon_socket')
+        if config.has_option('prism_central', 'daemon_refresh'):
+            self.daemon_refresh = config.getint('prism_central', 'daemon_refresh')
+
+        # API timeout
+        if config.has_option('prism_central', 'timeout'):
+            self.timeout = config.getint('prism_central', 'timeout')
+
+        # Federation regions, one [prism_central:NAME] section each
+        for section in config.sections():
+            if not section.startswith('prism_central:'):
+                continue
+            name = PrismCentralInventory.to_safe(section.split(':', 1)[1].strip()).lower()
+            settings = {
+                'ip_addr': config.get(section, 'ip_addr') if config.has_option(section, 'ip_addr') else None,
+                'username': getattr(self, 'username', None),
+                'password': getattr(self, 'password', None),
+                'timeout': self.timeout
+            }
+            if config.has_option(section, 'username'):
+                settings['username'] = config.get(section, 'username')
+            if config.has_option(section, 'password'):
+                settings['password'] = config.get(section, 'password')
+            if config.has_option(section, 'timeout'):
+                settings['timeout'] = config.getint(section, 'timeout')
+            self.region_settings[name] = settings
+
     def read_environment(self):
         """ Reads the settings from environment variables """
         # Setup PC IP
@@ -405,12 +1393,33 @@ class PrismCentralInventory(object):
 
         parser.add_argument('--pretty', action='store_true', help='Pretty-print results')
 
+        parser.add_argument('--group', action='append', default=[], metavar='PATTERN',
+                            help='With --list, only output the groups matching PATTERN, a glob, and the variables '
+                                 'of their hosts (may be repeated or comma separated)')
+
+        parser.add_argument('--filter', action='append', default=[], metavar='KEY=VALUE',
+                            help='Only fetch VMs where KEY (%s) is one of the comma separated VALUE '
+                                 '(overrides the INI filter_KEY, may be repeated)' % ', '.join(FILTER_KEYS))
+
         parser.add_argument('--cache-path', action='store', help='Path to the cache files (default: .)')
         parser.add_argument('--cache-max_age', action='store', help='Maximum age of the cached items (default: 0)')
         parser.add_argument('--force-cache', action='store_true', default=False, help='Only use data from the cache')
         parser.add_argument('--refresh-cache', '-r', action='store_true', default=False,
                             help='Force refresh of cache by making API requests to PrismCentral (default: False - use cache files)')
 
+        parser.add_argument('--daemon', action='store_true',
+                            help='Keep the inventory in memory and answer --list and --host over daemon_socket')
+
+        parser.add_argument('--timings', action='store_true',
+                            help='Report the duration, bytes and entities of each phase and the cache hits '
+                                 'and misses as JSON on stderr')
+        parser.add_argument('--profile', action='store', metavar='FILE',
+                            help='Profile the run, worker threads included, with cProfile and dump the '
+                                 'stats to FILE')
+
+        # Internal, the background refresh of stale_while_revalidate
+        parser.add_argument('--revalidate', action='store_true', help=argparse.SUPPRESS)
+
         parser.add_argument('--env', '-e', action='store_true', help='Display PC_IP_ADDR, PC_USERNAME, PC_PASSWORD')
         parser.add_argument('--ip-addr', '-i', action='store', help='PrismCentral IP Address')
         parser.add_argument('--username', '-u', action='store', help='PrismCentral Username')
@@ -426,9 +1435,17 @@ class PrismCentralInventory(object):
             self.username = self.args.username
         if self.args.password:
             self.password = self.args.password
+        for patterns in self.args.group:
+            self.group_patterns.extend(pattern.strip() for pattern in patterns.split(',') if pattern.strip())
+        for criterion in self.args.filter:
+            key, _, value = criterion.partition('=')
+            if key.strip() not in FILTER_KEYS:
+                parser.error('unknown filter %s, expected one of %s' % (key, ', '.join(FILTER_KEYS)))
+            self.filter_criteria[key.strip()] = value
 
         # Make --list default if none of the other commands are specified
-        if (not self.args.vms and
+        if (not self.args.vms and not self.args.clusters and not self.args.projects and
+                not self.args.categories and not self.args.nodes and
                 not self.args.all and not self.args.host):
             self.args.list = True
 
@@ -436,49 +1453,276 @@ class PrismCentralInventory(object):
     # Data Management
     ###########################################################################
 
-    def load_from_prism_central(self, resource=None):
-        """Get JSON from PrismCentral API """
-        if self.args.force_cache and os.path.isfile(self.cache_filename):
+    def region(self, name, settings):
+        """ A copy of this inventory working against the PrismCentral of one
+        federation region, with its own data and cache files """
+        region = copy.copy(self)
+        region.region_name = name
+        region.regions = []
+        region.ip_addr = settings['ip_addr']
+        region.username = settings['username']
+        region.password = settings['password']
+        region.data = {}
+        region.sync = {}
+        region.cache_refreshed = set()
+        region.manager = PcManager(region.ip_addr, region.username, region.password,
+                                   page_size=self.page_size, max_workers=self.max_workers,
+                                   pool_size=self.pool_size, timeout=settings['timeout'], retries=self.retries,
+                                   compression=self.compression, timings=self.timings, codec=self.codec)
+        return region
+
+    def load_data(self, resource=None):
+        """ Load resource from PrismCentral, or from every federation region at once """
+        if not self.regions:
+            self.load_from_prism_central(resource)
             return
-        # We always get fresh vms
-        if self.is_cache_valid() and not (resource == 'vms' or resource is None):
-            return
-        if self.args.refresh_cache:
+
+        pool = ThreadPool(len(self.regions))
+        try:
+            pool.map(lambda region: region.load_region(resource), self.regions)
+        finally:
+            pool.close()
+            pool.join()
+
+        # Merge the entities of the regions
+        for name in RESOURCES:
+            if resource != name and resource is not None and not self.args.refresh_cache:
+                continue
+            self.data[name] = {'entities': []}
+            for region in self.regions:
+                if isinstance(region.data.get(name), dict):
+                    self.data[name]['entities'].extend(region.data[name].get('entities', []))
+
+    def load_region(self, resource):
+        """ Load resource from the PrismCentral of a federation region and
+        cache it. A failing region is reported and left out """
+        try:
+            self.load_from_prism_central(resource)
+            if self.cache_refreshed:
+                self.write_to_cache()
+        except Exception as e:
+            sys.stderr.write('Error loading PrismCentral region %s: %s\n' % (self.region_name, e))
+        finally:
+            self.unlock_cache()
+
+    def load_from_prism_central(self, resource=None):
+        """Get JSON from PrismCentral API. A single resource other than vms
+        is read from its cache file instead while that is still valid """
+        if self.args.refresh_cache and not self.args.force_cache:
             resource = None
 
-        if resource == 'vms' or resource is None:
-            self.data['vms'] = self.manager.list_vms()
-            self.cache_refreshed = True
-        if resource == 'clusters' or resource is None:
-            self.data['clusters'] = self.manager.list_clusters()
-            self.cache_refreshed = True
-        if resource == 'projects' or resource is None:
-            self.data['projects'] = self.manager.list_projects()
-            self.cache_refreshed = True
-        if resource == 'categories' or resource is None:
-            self.data['categories'] = self.manager.list_categories()
-            self.cache_refreshed = True
-        if resource == 'nodes' or resource is None:
-            self.data['nodes'] = self.manager.list_nodes()
-            self.cache_refreshed = True
+        resources = []
+        for name in RESOURCES:
+            if resource != name and resource is not None:
+                continue
+            if self.args.force_cache and self.load_from_cache(name):
+                continue
+            # We always get fresh vms
+            if (resource == name and name != 'vms' and
+                    self.is_cache_valid(name) and self.load_from_cache(name)):
+                continue
+            resources.append(name)
+
+        # Only one process refreshes the cache at a time. What another process
+        # refreshed while this one waited for the lock is read from the cache
+        # instead of being fetched again
+        if resources:
+            self.lock_cache()
+        for name in list(resources):
+            if self.refreshed_elsewhere(name) and self.load_from_cache(name):
+                self.timings.cache_status(self.cache_entry(name), 'refreshed elsewhere')
+                resources.remove(name)
+
+        # The cached VMs are the base of an incremental sync, even expired
+        if 'vms' in resources and self.incremental_sync and not self.args.refresh_cache:
+            if self.load_from_cache('vms'):
+                self.load_from_cache('sync')
+
+        # Resources are independent from each other, fetch them all at once
+        if len(resources) > 1:
+            pool = ThreadPool(len(resources))
+            try:
+                results = pool.map(self.fetch_resource, resources)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self.fetch_resource(name) for name in resources]
+
+        for name, result in zip(resources, results):
+            if isinstance(result, dict):
+                self.data[name] = result
+                self.cache_refreshed.add(name)
+            # Keep what the cache had for a resource that could not be fetched
+            elif not self.load_from_cache(name):
+                self.data[name] = result
+        if 'vms' in self.cache_refreshed:
+            self.sync['vms'] = max([self.sync.get('vms', 0)] +
+                                   [PcManager.last_update_time(vm) for vm in self.data['vms']['entities']])
+            self.cache_refreshed.add('sync')
+
+    def fetch_resource(self, resource):
+        """ Fetch one resource type from PrismCentral. Errors are reported
+        and returned instead of raised so one failing resource doesn't
+        affect the others """
+        try:
+            with self.timings.phase('fetch_' + resource):
+                if resource == 'vms' and self.can_sync_vms():
+                    result = self.sync_vms()
+                elif resource in self.filters:
+                    result = getattr(self.manager, 'list_' + resource)(self.filters[resource])
+                else:
+                    result = getattr(self.manager, 'list_' + resource)()
+        except Exception as e:
+            result = "408", None
+            sys.stderr.write('Error fetching %s from %s: %s\n' % (resource, self.ip_addr, e))
+        else:
+            if not isinstance(result, dict):
+                sys.stderr.write('Error fetching %s from %s: %s\n' % (resource, self.ip_addr, result))
+            else:
+                self.timings.count('fetch_' + resource, entities=len(result.get('entities', [])))
+        return result
+
+    def can_sync_vms(self):
+        """ Whether the cached VMs can be refreshed incrementally. Not with a
+        VM filter, a VM no longer matching it would not be seen as deleted """
+        return (self.incremental_sync and not self.args.refresh_cache and 'vms' not in self.filters and
+                'vms' in self.sync and isinstance(self.data.get('vms'), dict))
+
+    def sync_vms(self):
+        """ Incremental VM refresh: only the VMs updated since the last sync
+        are fetched, deleted VMs are found through a UUID-only listing and
+        both are patched into the cached VMs """
+        vms = self.data['vms']
+        updated = self.manager.list_vms_since(self.sync['vms'])
+        if not isinstance(updated, list):
+            return updated
+        uuids = self.manager.list_vm_uuids()
+        if not isinstance(uuids, list):
+            return uuids
+
+        entities = OrderedDict((vm['metadata']['uuid'], vm) for vm in vms['entities'])
+        for vm in updated:
+            entities[vm['metadata']['uuid']] = vm
+        uuids = set(uuids)
+        vms['entities'] = [vm for uuid, vm in entities.items() if uuid in uuids]
+        if 'metadata' in vms:
+            vms['metadata']['total_matches'] = len(vms['entities'])
+            vms['metadata']['length'] = len(vms['entities'])
+        return vms
 
     def add_inventory_group(self, key):
         """ Method to create group dict """
         host_dict = {'hosts': [], 'vars': {}}
         self.inventory[key] = host_dict
+        self.groups[key] = OrderedDict()
         return
 
     def add_host(self, group, host):
-        """ Helper method to reduce host duplication """
+        """ Helper method to reduce host duplication.
+        Hosts are indexed in an insertion ordered set while building and only
+        copied into the inventory group lists by build_inventory """
         if group not in self.inventory:
             self.add_inventory_group(group)
 
-        if host not in self.inventory[group]['hosts']:
-            self.inventory[group]['hosts'].append(host)
+        self.groups[group][host] = None
         return
 
-    def build_inventory(self):
-        """ Build Ansible inventory of vms """
+    def group_name(self, prefix, name, value=None):
+        """ Memoized group name for a VM attribute, or for a category and its value """
+        key = (prefix, name, value)
+        group = self.group_names.get(key)
+        if group is None:
+            group = prefix + name.lower()
+            if value is not None:
+                group += "_" + PrismCentralInventory.to_safe(value).lower()
+            self.group_names[key] = group
+        return group
+
+    def build_filters(self):
+        """ Translates the filter criteria into the v3 FIQL filter of each list
+        call and derives the key that keeps the cache of each filtered view apart """
+        terms = []
+        for key, attribute in (('power_state', 'power_state'),
+                               ('cluster', 'cluster_name'),
+                               ('project', 'project_name')):
+            if self.filter_criteria.get(key):
+                term = PrismCentralInventory.fiql(attribute, self.filter_criteria[key])
+                if term:
+                    terms.append(term)
+        if self.filter_criteria.get('category'):
+            categories = []
+            for category in self.filter_criteria['category'].split(','):
+                if not category.strip():
+                    continue
+                name, _, value = category.partition(':')
+                categories.append('categories.%s==%s' % (PrismCentralInventory.fiql_quote(name.strip()),
+                                                         PrismCentralInventory.fiql_quote(value.strip())))
+            if categories:
+                terms.append('(%s)' % ','.join(categories) if len(categories) > 1 else categories[0])
+        if self.filter_criteria.get('fiql'):
+            terms.append('(%s)' % self.filter_criteria['fiql'])
+
+        self.filters = {}
+        if terms:
+            self.filters['vms'] = ';'.join(terms)
+        clusters = PrismCentralInventory.fiql('name', self.filter_criteria.get('cluster') or '')
+        if clusters:
+            self.filters['clusters'] = clusters
+
+        self.cache_key = ''
+        if self.filters:
+            self.cache_key = hashlib.sha1(json.dumps(self.filters, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def can_stream_vms(self):
+        """ Whether --list can be built from the VMs as they are streamed """
+        if (not self.streaming or self.args.force_cache or self.args.refresh_cache or
+                self.incremental_sync or self.regions):
+            return False
+        if ijson is None:
+            sys.stderr.write('streaming requires the ijson module, falling back to a full decode\n')
+            return False
+        return True
+
+    def stream_inventory(self):
+        """ Build the inventory from the VMs streamed by PrismCentral. Each VM
+        is written to the vms cache file as soon as it is decoded, the cache
+        file only replaces the previous one once the listing is complete """
+        cache_file = self.cache_file('vms')
+        cache_tmp = '%s.%d.tmp' % (cache_file, os.getpid())
+
+        # Another process may have streamed them while this one waited
+        self.lock_cache()
+        if self.refreshed_elsewhere('inventory') and self.load_from_cache('inventory'):
+            return
+
+        def spool(vms, cache):
+            for count, vm in enumerate(vms):
+                if count:
+                    cache.write(b',')
+                self.codec.dump(vm, cache, compact=True)
+                self.sync['vms'] = max(self.sync.get('vms', 0), PcManager.last_update_time(vm))
+                yield vm
+
+        try:
+            with self.open_cache(cache_tmp, 'w') as cache:
+                cache.write(b'{"entities":[')
+                with self.timings.phase('stream_inventory'):
+                    self.build_inventory(spool(self.manager.stream_entities("vms/list", self.filters.get('vms', "")),
+                                               cache))
+                cache.write(b']}')
+            os.rename(cache_tmp, cache_file)
+        except Exception as e:
+            if os.path.isfile(cache_tmp):
+                os.remove(cache_tmp)
+            sys.stderr.write('Error streaming vms: %s\n' % e)
+            sys.exit(-1)
+        self.cache_refreshed.add('sync')
+        self.refresh_host_index()
+
+    def build_inventory(self, vms=None):
+        """ Build Ansible inventory of vms, from the cached vms unless an
+        iterable of vms is given """
         self.inventory = {
             'all': {
                 'hosts': [],
@@ -486,85 +1730,620 @@ class PrismCentralInventory(object):
             },
             '_meta': {'hostvars': {}}
         }
+        self.groups = {}
+        self.group_names = {}
+        self.host_index = {'keys': {}, 'uuids': {}, 'regions': {}}
+        self.host_regions = {}
+        self.references = {}
+
+        with self.timings.phase('build_inventory'):
+            if vms is not None:
+                for vm in vms:
+                    self.add_vm(vm)
+            elif self.regions:
+                for region in self.regions:
+                    if isinstance(region.data.get('vms'), dict):
+                        for vm in region.data['vms']['entities']:
+                            self.add_vm(vm, region.region_name)
+            else:
+                for vm in self.data['vms']['entities']:
+                    self.add_vm(vm)
+
+            for group, hosts in self.groups.items():
+                self.inventory[group]['hosts'] = list(hosts)
+        self.timings.count('build_inventory', hosts=len(self.inventory['all']['hosts']), groups=len(self.groups))
+
+    def add_vm(self, vm, region=None):
+        """ Add a vm to the inventory, by id and name. A vm from a federation
+        region also goes into the pc_REGION group, and is named REGION_IP when
+        another region already has a host at the same IP """
+        dest = None
+        for net in vm['status']['resources']['nic_list']:
+            if net['ip_endpoint_list']:
+                dest = net['ip_endpoint_list'][0]['ip']
+        if dest is None:
+            return
+        address = dest
+        if region and self.host_regions.setdefault(dest, region) != region:
+            dest = '%s_%s' % (region, dest)
+
+        self.inventory['all']['hosts'].append(dest)
+
+        self.add_host(vm['metadata']['uuid'], dest)
+
+        self.add_host(vm['status']['name'], dest)
+
+        ## groups that are always present
+        for group in (['prism_central',
+                       self.group_name('cluster_', vm['status']['cluster_reference']['name']),
+                       self.group_name('project_', vm['metadata']['project_reference']['name']),
+                       self.group_name('owner_', vm['metadata']['owner_reference']['name']),
+                       self.group_name('hypervisor_', vm['status']['resources']['hypervisor_type']),
+                       self.group_name('status_', vm['status']['resources']['power_state'])]):
+            self.add_host(group, dest)
+        if region:
+            self.add_host(self.group_name('pc_', region), dest)
+
+        ## groups that are not always present
+        for group in (vm['metadata']['categories']):
+            if group:
+                category = self.group_name('category_', group, vm['metadata']['categories'][group])
+                self.add_host(category, dest)
+
+        #if vm['labels']:
+        #    for tag in vm['labels']:
+        #        self.add_host(tag, dest)
+
+        # hostvars
+        info = self.host_vars(vm)
+        if dest != address:
+            info = dict(info, ansible_host=address)
+        self.inventory['_meta']['hostvars'][dest] = info
+        self.index_host(vm, info, dest, region)
+
+    def host_vars(self, vm):
+        """ Ansible variables of a vm: the whole entity, or the configured hostvars """
+        info = vm
+        if self.hostvars:
+            info = PrismCentralInventory.project(vm, self.hostvars)
+        if self.enrich:
+            info = dict(info, **self.enrichment(vm))
+        if self.pc_namespace_vars:
+            info = PrismCentralInventory.pc_namespace(info)
+        return info
+
+    def enrichment(self, vm):
+        """ Variables of the enrich setting for a vm, looked up in the
+        clusters, nodes and projects it references """
+        variables = {}
+        for table, hostvars in self.enrich.items():
+            resource, reference = REFERENCES[table]
+            reference_uuid = PrismCentralInventory.project(vm, [('uuid', reference)]).get('uuid')
+            entity = self.reference_index(resource).get(reference_uuid)
+            if entity is not None:
+                variables.update(PrismCentralInventory.project(entity, hostvars))
+        return variables
+
+    def reference_index(self, resource):
+        """ Entities of a referenced resource by UUID. The resource is only
+        loaded when first needed, from its cache file while that is valid """
+        index = self.references.get(resource)
+        if index is None:
+            if resource not in self.data:
+                self.load_data(resource)
+            entities = []
+            if isinstance(self.data.get(resource), dict):
+                entities = self.data[resource].get('entities', [])
+            index = dict((entity['metadata']['uuid'], entity) for entity in entities)
+            self.references[resource] = index
+        return index
+
+    def index_host(self, vm, info, dest, region=None):
+        """ Index the inventory host name of a vm by itself, UUID, name and
+        IP addresses. A name or IP address shared by several VMs
+        stays with the first one """
+        vm_uuid = vm['metadata']['uuid']
+        self.host_index['uuids'][dest] = vm_uuid
+        if region:
+            self.host_index['regions'][dest] = region
+        keys = self.host_index['keys']
+        keys[dest] = dest
+        keys.setdefault(vm_uuid, dest)
+        keys.setdefault(vm['status']['name'], dest)
+        for net in vm['status']['resources']['nic_list']:
+            for endpoint in net['ip_endpoint_list'] or []:
+                keys.setdefault(endpoint['ip'], dest)
+
+    def refresh_host_index(self):
+        """ Mark the inventory, the host index and the encoded host variables
+        it points to as refreshed """
+        self.build_hostvars()
+        self.cache_refreshed.update(['inventory', 'host_index', 'hostvars'])
+
+    def build_hostvars(self):
+        """ Encode the variables of each host of the inventory one after the
+        other, for the hostvars cache entry, and index where each one is """
+        self.hostvars_data, self.host_index['hostvars'] = self.encode_each(self.inventory['_meta']['hostvars'])
+        self.host_index['generation'] = '%d.%f' % (os.getpid(), time())
+
+    def encode_each(self, values):
+        """ Encodes each value of the dictionary values one after the other,
+        returns the encoded values and the offset and length of each one by key """
+        chunks = []
+        offsets = {}
+        offset = 0
+        for key, value in values.items():
+            data = self.codec.encode(value)
+            offsets[key] = (offset, len(data))
+            offset += len(data)
+            chunks.append(data)
+        return b''.join(chunks), offsets
+
+    def read_encoded(self, name, keys, generation, offsets):
+        """ The encoded values of keys read from the cache entry name, such
+        as the variables of hosts from hostvars, by key. None unless the entry
+        is the generation the offsets are for """
+        values = {}
+        try:
+            with self.open_cache(self.cache_file(name), 'r') as cache:
+                if cache.readline().rstrip() != generation.encode('ascii'):
+                    return None
+                start = cache.tell()
+                # In file order, a compressed cache can only seek forward cheaply
+                for key in sorted((key for key in keys if key in offsets), key=lambda key: offsets[key][0]):
+                    offset, length = offsets[key]
+                    cache.seek(start + offset)
+                    values[key] = cache.read(length)
+        except IOError:
+            return None
+        return values
 
-        # add all vms by id and name
-        for vm in self.data['vms']['entities']:
-            for net in vm['status']['resources']['nic_list']:
-                if net['ip_endpoint_list']:
-                    dest = net['ip_endpoint_list'][0]['ip']
-                else:
-                    continue
-        
-            self.inventory['all']['hosts'].append(dest)
-
-            self.add_host(vm['metadata']['uuid'], dest)
-
-            self.add_host(vm['status']['name'], dest)
-
-            ## groups that are always present
-            for group in (['prism_central',
-                           'cluster_' + vm['status']['cluster_reference']['name'].lower(),
-                           'project_' + vm['metadata']['project_reference']['name'].lower(),
-                           'owner_' + vm['metadata']['owner_reference']['name'].lower(),
-                           'hypervisor_' + vm['status']['resources']['hypervisor_type'].lower(),
-                           'status_' + vm['status']['resources']['power_state'].lower()]):
-                self.add_host(group, dest)
-   
-            ## groups that are not always present
-            for group in (vm['metadata']['categories']):
-                if group:
-                    category = 'category_' + group.lower() + "_" + PrismCentralInventory.to_safe(vm['metadata']['categories'][group]).lower()
-                    self.add_host(category, dest)
-   
-            #if vm['labels']:
-            #    for tag in vm['labels']:
-            #        self.add_host(tag, dest)
-
-            # hostvars
-            #info = self.pc_namespace(vm)
-            self.inventory['_meta']['hostvars'][dest] = vm
+    def load_hostvars(self, generation, offsets):
+        """ The variables of every host, decoded from the hostvars cache entry
+        in one go. None unless the entry is the generation the offsets are for """
+        try:
+            with self.open_cache(self.cache_file('hostvars'), 'r') as cache:
+                if cache.readline().rstrip() != generation.encode('ascii'):
+                    return None
+                data = cache.read()
+        except IOError:
+            return None
+        return self.codec.loads(b'{' + b','.join(self.codec.encode(host) + b':' + data[offset:offset + length]
+                                                 for host, (offset, length) in offsets.items()) + b'}')
 
     def load_vm_variables_for_host(self):
-        """ Generate a JSON response to a --host call """
+        """ Generate a JSON response to a --host call.
+        The host index built with the inventory answers while it is valid,
+        only the variables of the host are read from the cache. Otherwise an
+        indexed host costs a single vms/<uuid> call and only an unknown host
+        is searched for """
         host = self.args.host
-        result = self.manager.search(host)
-        vm_uuid = result['query_term_list'][0]['token_list'][0]['identifier']['value']
+        vm_uuid = None
+        regions = self.regions or [self]
+        if self.load_from_cache('host_index') and host in self.host_index['keys']:
+            dest = self.host_index['keys'][host]
+            # --refresh-cache still gets the VM from PrismCentral, by its indexed UUID
+            if not self.args.refresh_cache and (self.args.force_cache or self.is_cache_valid('host_index')):
+                hostvars = self.read_encoded('hostvars', [dest], self.host_index.get('generation', ''),
+                                             self.host_index.get('hostvars', {}))
+                if hostvars and dest in hostvars:
+                    return {'vm': self.codec.loads(hostvars[dest])}
+            vm_uuid = self.host_index['uuids'][dest]
+            region_name = self.host_index['regions'].get(dest)
+            regions = [region for region in regions if region.region_name == region_name] or regions
+
+        for region in regions:
+            vm = region.find_vm(host, vm_uuid)
+            if vm:
+                return {'vm': self.host_vars(vm)}
+        sys.stderr.write('Could not find a VM for host %s\n' % host)
+        return {}
+
+    def find_vm(self, host, vm_uuid=None):
+        """ Get the VM of vm_uuid, or of the VM found by searching for host """
+        if not vm_uuid:
+            result = self.manager.search(host)
+            try:
+                vm_uuid = result['query_term_list'][0]['token_list'][0]['identifier']['value']
+            except (KeyError, IndexError, TypeError):
+                return None
         vm = self.manager.get_vm(vm_uuid)
-        #info = self.pc_namespace(vm)
-        return {'vm': vm}
+        if not isinstance(vm, dict):
+            return None
+        return vm
 
     ###########################################################################
     # Cache Management
     ###########################################################################
 
-    def is_cache_valid(self):
-        """ Determines if the cache files have expired, or if it is still valid """
-        if os.path.isfile(self.cache_filename):
-            mod_time = os.path.getmtime(self.cache_filename)
-            current_time = time()
-            if (mod_time + self.cache_max_age) > current_time:
-                return True
+    def cache_file(self, name):
+        """ Path of the cache file of an entry: a resource, the inventory or the sync state.
+        Entries that depend on the filters are kept apart for each filtered view """
+        if self.cache_key and name not in UNFILTERED_RESOURCES:
+            name = '%s.%s' % (name, self.cache_key)
+        if self.region_name:
+            name = '%s.%s' % (self.region_name, name)
+        filename = os.path.join(self.cache_path, 'ansible-prism_central.%s.cache' % name)
+        if self.cache_compress:
+            filename += '.gz'
+        return filename
+
+    def cache_entry(self, name):
+        """ Name of a cache entry in the --timings report """
+        if self.region_name:
+            return '%s.%s' % (self.region_name, name)
+        return name
+
+    def open_cache(self, filename, mode):
+        """ Opens a cache file, gzip compressed if cache_compress is set """
+        if self.cache_compress:
+            return gzip.open(filename, mode + 'b', CACHE_COMPRESSLEVEL)
+        return open(filename, mode + 'b')
+
+    def cache_age(self, name):
+        """ Seconds since the cache file of an entry was written, None if there is none """
+        filename = self.cache_file(name)
+        if os.path.isfile(filename):
+            return time() - os.path.getmtime(filename)
+        return None
+
+    def is_cache_valid(self, name):
+        """ Determines if the cache file of an entry has expired, or if it is still valid """
+        # Entries derived from the VMs expire with them
+        resource = name if name in RESOURCES else 'vms'
+        age = self.cache_age(name)
+        if age is not None and age < self.cache_max_ages.get(resource, self.cache_max_age):
+            return True
+        self.timings.cache_status(self.cache_entry(name), 'miss' if age is None else 'expired')
         return False
 
-    def load_from_cache(self):
-        """ Reads the data from the cache file and assigns it to member variables as Python Objects """
+    def load_from_cache(self, name):
+        """ Reads the cache entry of name and assigns it to member variables as Python Objects.
+        Returns False when there is no such entry """
+        filename = self.cache_file(name)
         try:
-            with open(self.cache_filename, 'r') as cache:
-                json_data = cache.read()
-            data = json.loads(json_data)
+            with self.timings.phase('load_from_cache'):
+                with self.open_cache(filename, 'r') as cache:
+                    value = self.codec.load(cache)
+        except (IOError, ValueError):
+            self.timings.cache_status(self.cache_entry(name), 'miss')
+            return False
+        self.timings.cache_status(self.cache_entry(name), 'hit')
+        self.timings.count('load_from_cache', bytes=os.path.getsize(filename))
+
+        if name == 'inventory':
+            meta = value.get('_meta', {})
+            if 'hostvars_offsets' in meta:
+                hostvars = self.load_hostvars(meta['hostvars_generation'], meta['hostvars_offsets'])
+                if hostvars is None:
+                    self.timings.cache_status(self.cache_entry(name), 'miss')
+                    return False
+                value['_meta'] = {'hostvars': hostvars}
+            self.inventory = value
+        elif name == 'host_index':
+            self.host_index = value
+        elif name == 'group_index':
+            self.group_index = value
+        elif name == 'sync':
+            self.sync = value
+        else:
+            self.data[name] = value
+        return True
+
+    def write_to_cache(self):
+        """ Writes the refreshed cache entries in compact JSON format, one file each """
+        for name in self.cache_refreshed:
+            if name == 'inventory':
+                # The host variables are only written once, to the hostvars entry
+                value = dict(self.inventory)
+                value['_meta'] = {'hostvars_generation': self.host_index['generation'],
+                                  'hostvars_offsets': self.host_index['hostvars']}
+            elif name == 'host_index':
+                value = self.host_index
+            elif name == 'sync':
+                value = self.sync
+            elif name == 'group_index':
+                value = self.group_index
+            elif name in ('output', 'hostvars', 'groups'):
+                value = None
+            else:
+                value = self.data[name]
+            # Readers only ever see a complete file
+            cache_file = self.cache_file(name)
+            cache_tmp = '%s.%d.tmp' % (cache_file, os.getpid())
+            with self.timings.phase('write_to_cache'):
+                with self.open_cache(cache_tmp, 'w') as cache:
+                    if name == 'output':
+                        # Stamped with the settings it was produced with
+                        cache.write(self.settings_stamp() + b'\n')
+                        cache.write(self.output)
+                    elif name == 'hostvars':
+                        # Stamped with the host index it goes with
+                        cache.write(self.host_index['generation'].encode('ascii') + b'\n')
+                        cache.write(self.hostvars_data)
+                    elif name == 'groups':
+                        # Stamped with the group index it goes with
+                        cache.write(self.group_index['generation'].encode('ascii') + b'\n')
+                        cache.write(self.groups_data)
+                    else:
+                        self.codec.dump(value, cache, compact=True)
+            self.timings.count('write_to_cache', bytes=os.path.getsize(cache_tmp))
+            os.rename(cache_tmp, cache_file)
+
+    def emit_cached_output(self):
+        """ Copy the cached --list output to stdout, without decoding it, when
+        it was produced with the current settings and is still valid, or
+        still servable in stale_while_revalidate mode """
+        if self.args.pretty:
+            return False
+        servable, stale = self.is_servable('output')
+        if not servable:
+            return False
+
+        with self.timings.phase('cached_output'):
+            try:
+                with self.open_cache(self.cache_file('output'), 'r') as cache:
+                    if cache.readline().rstrip() != self.settings_stamp():
+                        return False
+                    shutil.copyfileobj(cache, getattr(sys.stdout, 'buffer', sys.stdout), 1024 * 1024)
+            except IOError:
+                return False
+        self.timings.cache_status('output', 'hit')
+        if stale:
+            self.revalidate_in_background()
+        return True
+
+    def is_servable(self, name):
+        """ Whether the cached entry of name can answer --list as is, and if
+        so whether it is stale and needs a background refresh """
+        if self.args.refresh_cache or self.args.revalidate:
+            return False, False
+        age = self.cache_age(name)
+        if age is None:
+            return False, False
+        stale = not (self.args.force_cache or self.is_cache_valid(name))
+        if stale and not (self.stale_while_revalidate and age < self.cache_max_stale):
+            return False, False
+        return True, stale
+
+    def build_group_index(self):
+        """ Index of the inventory for --group: where each group is in the
+        groups cache entry. A group is encoded with its hosts, its variables
+        and where the encoded variables of each of its hosts are in the
+        hostvars cache entry, see build_hostvars """
+        hostvars = self.host_index['hostvars']
+        self.groups_data, offsets = self.encode_each(dict(
+            (group, {'group': value, 'hostvars': [hostvars[host] for host in value.get('hosts', [])]})
+            for group, value in self.inventory.items() if group != '_meta'))
+        self.group_index = {
+            'stamp': self.settings_stamp().decode('ascii'),
+            'generation': self.host_index['generation'],
+            'groups': offsets
+        }
+
+    def select_groups(self, groups):
+        """ The groups matching the --group patterns """
+        return [group for group in groups
+                if group != '_meta' and any(fnmatch.fnmatchcase(group, pattern) for pattern in self.group_patterns)]
+
+    def group_subset(self, inventory):
+        """ The groups of inventory matching the --group patterns and the
+        variables of their hosts """
+        subset = {}
+        hosts = OrderedDict()
+        for group in self.select_groups(inventory):
+            subset[group] = inventory[group]
+            for host in inventory[group].get('hosts', []):
+                hosts[host] = None
+        hostvars = inventory['_meta']['hostvars']
+        subset['_meta'] = {'hostvars': dict((host, hostvars.get(host, {})) for host in hosts)}
+        return subset
+
+    def emit_group_subset(self):
+        """ Answer --list --group from the cached group index. Only the
+        selected groups are read from the groups cache entry, and the variables
+        of their hosts from the hostvars one, copied as they were encoded """
+        servable, stale = self.is_servable('group_index')
+        if not servable or not self.load_from_cache('group_index'):
+            return False
+        if self.group_index.get('stamp') != self.settings_stamp().decode('ascii'):
+            return False
+
+        with self.timings.phase('group_subset'):
+            generation = self.group_index['generation']
+            selected = self.select_groups(self.group_index['groups'])
+            groups = self.read_encoded('groups', selected, generation, self.group_index['groups'])
+            if groups is None:
+                return False
+            subset = {}
+            offsets = OrderedDict()
+            for group in selected:
+                entry = self.codec.loads(groups[group])
+                subset[group] = entry['group']
+                for host, offset in zip(entry['group'].get('hosts', []), entry['hostvars']):
+                    offsets[host] = offset
+
+            hostvars = self.read_encoded('hostvars', offsets, generation, offsets)
+            if hostvars is None:
+                return False
+
+            if self.args.pretty:
+                subset['_meta'] = {'hostvars': dict((host, self.codec.loads(data)) for host, data in hostvars.items())}
+                output = self.codec.encode(subset, indent=2) + b'\n'
+            else:
+                meta = (b'"_meta": {"hostvars": {' +
+                        b', '.join(self.codec.encode(host) + b': ' + data for host, data in hostvars.items()) + b'}}')
+                output = self.codec.encode(subset)
+                output = (output[:-1] + b', ' if subset else b'{') + meta + b'}\n'
+            getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+        self.timings.count('group_subset', hosts=len(hostvars), bytes=len(output))
+        if stale:
+            self.revalidate_in_background()
+        return True
+
+    def settings_stamp(self):
+        """ Hash of the settings the --list output depends on """
+        settings = [self.filters, self.hostvars, self.enrich, self.pc_namespace_vars, self.group_variables,
+                    [(name, settings['ip_addr']) for name, settings in self.region_settings.items()]]
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest().encode('ascii')
+
+    def lock_cache(self):
+        """ Take the lock of the cache refresh, waiting while another process
+        holds it. It is held until unlock_cache, once the refreshed entries are
+        written. Without a usable cache_path the refresh goes unlocked """
+        if self.cache_lock is not None:
+            return
+        waited = time()
+        try:
+            lock = open(self.cache_file('vms') + '.lock', 'a')
         except IOError:
-            data = {'data': {}, 'inventory': {}}
+            return
+        with self.timings.phase('cache_lock'):
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        self.cache_lock = lock
+        self.lock_waited = waited
+
+    def unlock_cache(self):
+        if self.cache_lock is not None:
+            self.cache_lock.close()
+            self.cache_lock = None
+
+    def refreshed_elsewhere(self, name):
+        """ Whether another process wrote the cache entry of name while this
+        one waited for the cache lock """
+        if self.lock_waited is None:
+            return False
+        try:
+            return os.path.getmtime(self.cache_file(name)) >= self.lock_waited
+        except OSError:
+            return False
+
+    def load_cached_inventory(self):
+        """ In stale_while_revalidate mode, serve the cached inventory for --list
+        until it is cache_max_stale old. Once the VMs cache_max_age is over, it
+        is served stale while a background process refreshes it """
+        if not self.stale_while_revalidate or self.args.refresh_cache or self.args.revalidate:
+            return False
+        age = self.cache_age('inventory')
+        if age is None or age >= self.cache_max_stale or not self.load_from_cache('inventory'):
+            return False
+        if not self.is_cache_valid('inventory'):
+            self.revalidate_in_background()
+        return True
+
+    def revalidate_in_background(self):
+        """ Start a detached run of this script refreshing the cache with the same
+        arguments, unless one is already running """
+        marker = self.cache_file('inventory') + '.revalidating'
+        try:
+            if time() - os.path.getmtime(marker) < REVALIDATE_TIMEOUT:
+                return
+            os.remove(marker)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        except OSError:
+            return
 
-        self.data = data['data']
-        self.inventory = data['inventory']
+        with open(os.devnull, 'r+') as devnull:
+            subprocess.Popen([sys.executable, os.path.realpath(__file__)] + sys.argv[1:] + ['--revalidate'],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, preexec_fn=os.setsid)
 
-    def write_to_cache(self):
-        """ Writes data in JSON format to a file """
-        data = {'data': self.data, 'inventory': self.inventory}
-        json_data = json.dumps(data, indent=2)
+    ###########################################################################
+    # Daemon mode
+    ###########################################################################
 
-        with open(self.cache_filename, 'w') as cache:
-            cache.write(json_data)
+    def run_daemon(self):
+        """ Serve --list and --host over daemon_socket from the inventory kept
+        in memory, refreshing it every daemon_refresh seconds """
+        if not self.daemon_socket:
+            sys.stderr.write('--daemon requires daemon_socket to be set in the ini file\n')
+            sys.exit(-1)
+
+        self.refresh_daemon()
+        refresher = threading.Thread(target=self.refresh_daemon_forever)
+        refresher.daemon = True
+        refresher.start()
+
+        if os.path.exists(self.daemon_socket):
+            os.remove(self.daemon_socket)
+        server = DaemonServer(self.daemon_socket, DaemonHandler)
+        server.inventory = self
+        os.chmod(self.daemon_socket, 0o600)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(self.daemon_socket)
+
+    def refresh_daemon(self):
+        """ Refresh the VMs and rebuild the inventory, then swap in what is served """
+        self.cache_refreshed = set()
+        # The referenced resources are loaded again once their cache expires
+        for table in self.enrich:
+            self.data.pop(REFERENCES[table][0], None)
+        self.load_data('vms')
+        if not isinstance(self.data.get('vms'), dict):
+            raise IOError('Could not get the VMs from PrismCentral %s' % self.ip_addr)
+        self.build_inventory()
+        self.output = self.codec.encode(self.inventory) + b'\n'
+        self.refresh_host_index()
+        if self.cache_output:
+            self.cache_refreshed.add('output')
+        if self.cache_group_index:
+            self.build_group_index()
+            self.cache_refreshed.update(['group_index', 'groups'])
+        self.write_to_cache()
+        self.unlock_cache()
+        self.served = (self.inventory, self.host_index, self.output)
+
+    def refresh_daemon_forever(self):
+        while True:
+            sleep(self.daemon_refresh)
+            try:
+                self.refresh_daemon()
+            except Exception as e:
+                sys.stderr.write('Error refreshing the inventory: %s\n' % e)
+
+    def daemon_answer(self, request):
+        """ Answer of the daemon to a client request, empty when the client
+        should rather answer by itself """
+        if request.get('key') != self.cache_key:
+            return b''
+        inventory, host_index, output = self.served
+        if request.get('host'):
+            dest = host_index['keys'].get(request['host'])
+            if dest is None:
+                return b''
+            inventory = {'vm': inventory['_meta']['hostvars'][dest]}
+        elif not request.get('pretty'):
+            return output
+        if request.get('pretty'):
+            return self.codec.encode(inventory, indent=2) + b'\n'
+        return self.codec.encode(inventory) + b'\n'
+
+    def ask_daemon(self):
+        """ Answer of a running daemon to this --list or --host call, None
+        when no daemon is listening """
+        request = {'key': self.cache_key, 'host': self.args.host, 'pretty': self.args.pretty}
+        chunks = []
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self.daemon_socket)
+            client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            while True:
+                chunk = client.recv(64 * 1024)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except socket.error:
+            return None
+        finally:
+            client.close()
+        return b''.join(chunks)
 
     ###########################################################################
     # Utilities
@@ -574,15 +2353,165 @@ class PrismCentralInventory(object):
         """ Converts 'bad' characters in a string to underscores so they can be used as Ansible groups """
         return re.sub(r"[^A-Za-z0-9\-.]", "_", word)
 
-    #@staticmethod
-    #def pc_namespace(data):
-    #    """ Returns a copy of the dictionary with all the keys put in a 'pc_' namespace """
-    #    info = {}
-    #    for k, v in data.items():
-    #        info['pc_' + k] = v
-    #    return info
+    @staticmethod
+    def pc_namespace(data):
+        """ Returns a copy of the dictionary with all the keys put in a 'pc_' namespace """
+        info = {}
+        for k, v in data.items():
+            info['pc_' + k] = v
+        return info
+
+    @staticmethod
+    def fiql(attribute, values):
+        """ FIQL expression matching attribute to any of the comma separated
+        values, None when there are no values """
+        terms = ['%s==%s' % (attribute, PrismCentralInventory.fiql_quote(value.strip()))
+                 for value in values.split(',') if value.strip()]
+        if not terms:
+            return None
+        if len(terms) > 1:
+            return '(%s)' % ','.join(terms)
+        return terms[0]
+
+    @staticmethod
+    def fiql_quote(value):
+        """ Percent-encodes the FIQL operators in a value, so a name
+        holding them cannot change the expression """
+        return re.sub(r"[%,;()]", lambda match: '%%%02X' % ord(match.group()), value)
+
+    @staticmethod
+    def compile_hostvars(spec):
+        """ Parses the hostvars setting, a comma separated list of dotted paths
+        into the VM entity, each optionally named with 'name=path'. A path
+        without a name is named after the path with dots turned to underscores """
+        hostvars = []
+        for item in re.split(r"[,\n]", spec):
+            item = item.strip()
+            if not item:
+                continue
+            if '=' in item:
+                name, path = [part.strip() for part in item.split('=', 1)]
+            else:
+                name, path = item.replace('.', '_'), item
+            hostvars.append((name, tuple(path.split('.'))))
+        return hostvars
+
+    @staticmethod
+    def compile_enrich(spec):
+        """ Parses the enrich setting, hostvars whose paths start with the
+        referenced cluster, node or project, into the compiled hostvars of
+        each of them """
+        enrich = OrderedDict()
+        for name, path in PrismCentralInventory.compile_hostvars(spec):
+            if path[0] not in REFERENCES or len(path) < 2:
+                sys.stderr.write('enrich path %s must start with one of %s\n' % ('.'.join(path), ', '.join(REFERENCES)))
+                sys.exit(-1)
+            enrich.setdefault(path[0], []).append((name, path[1:]))
+        return enrich
+
+    @staticmethod
+    def project(data, hostvars):
+        """ Returns the values found at the compiled hostvars paths of data,
+        paths missing from data are left out """
+        info = {}
+        for name, path in hostvars:
+            value = data
+            for key in path:
+                if isinstance(value, dict) and key in value:
+                    value = value[key]
+                elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                    value = value[int(key)]
+                else:
+                    break
+            else:
+                info[name] = value
+        return info
+
+
+if BaseInventoryPlugin is not None:
+
+    class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+        """ Ansible inventory plugin adding the hosts and groups of --list
+        straight to the Ansible inventory. The VMs fetched from PrismCentral
+        are kept by the configured Ansible cache plugin """
+
+        NAME = 'prism_central'
+
+        def verify_file(self, path):
+            """ Only YAML files named *prism_central.yml or *prism_central.yaml """
+            return (super(InventoryModule, self).verify_file(path) and
+                    path.endswith(('prism_central.yml', 'prism_central.yaml')))
+
+        def parse(self, inventory, loader, path, cache=True):
+            super(InventoryModule, self).parse(inventory, loader, path, cache)
+            self._read_config_data(path)
+
+            builder = PrismCentralInventory(run=False)
+            # YAML 1.1 reads an unquoted on or off as a boolean
+            builder.filter_criteria = dict((key, {True: 'on', False: 'off'}.get(value, value)
+                                            if isinstance(value, bool) else str(value))
+                                           for key, value in self.get_option('filters').items())
+            builder.hostvars = PrismCentralInventory.compile_hostvars(','.join(self.get_option('hostvars')))
+            builder.pc_namespace_vars = self.get_option('pc_namespace')
+            builder.group_variables = self.get_option('group_variables')
+            builder.build_filters()
+
+            # The built inventory is cached rather than the VMs, it only holds
+            # the projected host variables and is much smaller
+            cache_key = self.get_cache_key(path)
+            read_cache = self.get_option('cache') and cache
+            update_cache = self.get_option('cache') and not cache
+            inventory = None
+            if read_cache:
+                try:
+                    inventory = self._cache[cache_key]
+                except KeyError:
+                    update_cache = True
+            if inventory is None:
+                builder.build_inventory(self.fetch_vms(builder)['entities'])
+                inventory = builder.inventory
+            if update_cache:
+                self._cache[cache_key] = inventory
+
+            self.populate(inventory)
+
+        def fetch_vms(self, builder):
+            """ The VMs matching the filters, from PrismCentral """
+            ip_addr = self.get_option('ip_addr')
+            manager = PcManager(ip_addr, self.get_option('username'), self.get_option('password'),
+                                page_size=self.get_option('page_size'), max_workers=self.get_option('max_workers'),
+                                pool_size=self.get_option('pool_size'), timeout=self.get_option('timeout'),
+                                retries=self.get_option('retries'), compression=self.get_option('compression'),
+                                timings=builder.timings)
+            vms = manager.list_vms(builder.filters.get('vms', ""))
+            if not isinstance(vms, dict):
+                raise AnsibleError('Error fetching vms from %s: %s' % (ip_addr, vms))
+            return vms
+
+        def populate(self, inventory):
+            """ Add the hosts and groups of inventory, as built for --list, to the Ansible inventory """
+            for key, value in inventory['all'].get('vars', {}).items():
+                self.inventory.set_variable('all', key, value)
+            for group, value in inventory.items():
+                if group in ('all', '_meta'):
+                    continue
+                group = self.inventory.add_group(group)
+                for host in value['hosts']:
+                    self.inventory.add_host(host, group=group)
+
+            strict = self.get_option('strict')
+            hostvars = inventory['_meta']['hostvars']
+            for host in inventory['all']['hosts']:
+                self.inventory.add_host(host)
+                for key, value in hostvars[host].items():
+                    self.inventory.set_variable(host, key, value)
+                self._set_composite_vars(self.get_option('compose'), hostvars[host], host, strict=strict)
+                self._add_host_to_composed_groups(self.get_option('groups'), hostvars[host], host, strict=strict)
+                self._add_host_to_keyed_groups(self.get_option('keyed_groups'), hostvars[host], host, strict=strict)
 
 
 ###########################################################################
 # Run the script
-PrismCentralInventory()
\ No newline at end of file
+if __name__ == '__main__':
+    socket.setdefaulttimeout(TIMEOUT)
+    PrismCentralInventory()
\ No newline at end of file